@@ -0,0 +1,166 @@
+import asyncio
+import math
+import os
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from fastapi import HTTPException, Request
+
+from extraction import page_budget
+from ingest import IngestedFile
+from metrics import registry, span
+
+
+# Cost units one process may have in flight; a text page costs TEXT_PAGE_COST,
+# an image page (which goes to OCR) OCR_PAGE_COST
+ADMISSION_BUDGET = float(os.getenv("ADMISSION_BUDGET", "100"))
+TEXT_PAGE_COST = float(os.getenv("ADMISSION_TEXT_PAGE_COST", "1"))
+OCR_PAGE_COST = float(os.getenv("ADMISSION_OCR_PAGE_COST", "10"))
+ADMISSION_QUEUE_DEPTH = int(os.getenv("ADMISSION_QUEUE_DEPTH", "16"))
+ADMISSION_CLIENT_QUEUE = int(os.getenv("ADMISSION_CLIENT_QUEUE", "4"))
+# Queued requests give up with a 429 after this long
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))
+# Set by the proxy in front of the app; the socket peer is the proxy itself
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "fly-client-ip")
+
+rejected = registry.counter("admission_rejected_total", "Requests refused with 429, by reason")
+
+
+def estimate_cost(files: Dict[str, IngestedFile]) -> float:
+    """Upper bound of the work of a request, from what ingest_upload counted."""
+    cost = 0.0
+    for name, ingested in files.items():
+        # Unreadable files are rejected by the validators without any work
+        pages = min(ingested.page_count, page_budget(name) or ingested.page_count)
+        image_pages = min(ingested.image_pages, pages)
+        cost += (pages - image_pages) * TEXT_PAGE_COST + image_pages * OCR_PAGE_COST
+    return cost
+
+
+def client_key(request: Request) -> str:
+    forwarded = request.headers.get(ADMISSION_CLIENT_HEADER)
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class AdmissionController:
+    """Bounds the estimated work in flight and queues the rest, fairly.
+
+    A request runs at once when its cost fits in what is left of the budget
+    and nobody is waiting. Otherwise it waits in a per-client queue; the
+    queues are served round-robin, so one client sending a burst of scanned
+    uploads cannot hold everybody else back. When the queue is full, the
+    client already has ADMISSION_CLIENT_QUEUE requests waiting, or the wait
+    exceeds ADMISSION_MAX_WAIT, the request is refused with 429 and a
+    Retry-After estimated from recent throughput. A request costing more
+    than the whole budget runs on its own.
+    """
+
+    def __init__(
+        self,
+        budget: float = ADMISSION_BUDGET,
+        queue_depth: int = ADMISSION_QUEUE_DEPTH,
+        client_queue: int = ADMISSION_CLIENT_QUEUE,
+        max_wait: float = ADMISSION_MAX_WAIT,
+    ):
+        self.budget = budget
+        self.queue_depth = queue_depth
+        self.client_queue = client_queue
+        self.max_wait = max_wait
+        self.in_flight = 0.0
+        self.queued = 0
+        self.queued_cost = 0.0
+        # client -> deque of (cost, future) waiting for admission
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        # Moving average of how long one cost unit takes, for Retry-After
+        self._seconds_per_unit = 0.1
+
+    def _refuse(self, reason: str, detail: str) -> HTTPException:
+        rejected.inc(reason=reason)
+        backlog = self.in_flight + self.queued_cost
+        retry_after = max(1, math.ceil(backlog * self._seconds_per_unit / max(1.0, self.budget / 2)))
+        return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+
+    def _wake(self) -> None:
+        # Round-robin over the clients; stop at the first head that does not fit
+        # so large requests are not starved by a stream of small ones
+        while self._queues:
+            client, waiters = next(iter(self._queues.items()))
+            cost, future = waiters[0]
+            if self.in_flight and self.in_flight + cost > self.budget:
+                return
+            waiters.popleft()
+            self.queued -= 1
+            self.queued_cost -= cost
+            self._queues.pop(client)
+            if waiters:
+                self._queues[client] = waiters
+            if not future.done():
+                self.in_flight += cost
+                future.set_result(None)
+
+    def _withdraw(self, client: str, cost: float, future: asyncio.Future) -> None:
+        waiters = self._queues.get(client)
+        if waiters is not None and (cost, future) in waiters:
+            waiters.remove((cost, future))
+            self.queued -= 1
+            self.queued_cost -= cost
+            if not waiters:
+                self._queues.pop(client)
+
+    @asynccontextmanager
+    async def admit(self, cost: float, client: str, shed: bool = True):
+        """Hold `cost` units of the budget for the duration of the block.
+
+        With shed=False (background jobs) the caller waits as long as it
+        takes instead of being refused.
+        """
+        cost = min(cost, self.budget)
+        if not self._queues and (not self.in_flight or self.in_flight + cost <= self.budget):
+            self.in_flight += cost
+        else:
+            if shed and self.queued >= self.queue_depth:
+                raise self._refuse("queue_full", "Too many requests are waiting; try again later")
+            if shed and len(self._queues.get(client, ())) >= self.client_queue:
+                raise self._refuse("client_queue_full", "Too many of your requests are waiting; try again later")
+            future = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(client, deque()).append((cost, future))
+            self.queued += 1
+            self.queued_cost += cost
+            try:
+                with span("queue"):
+                    await asyncio.wait_for(asyncio.shield(future), self.max_wait if shed else None)
+            except asyncio.TimeoutError:
+                self._withdraw(client, cost, future)
+                if future.done():
+                    # Admitted just as the wait ran out; hand the slot on
+                    self.in_flight -= cost
+                    self._wake()
+                raise self._refuse("timeout", f"Not admitted within {self.max_wait:g} seconds; try again later")
+            except BaseException:
+                self._withdraw(client, cost, future)
+                if future.done():
+                    self.in_flight -= cost
+                    self._wake()
+                raise
+
+        started = asyncio.get_running_loop().time()
+        try:
+            yield
+        finally:
+            self.in_flight -= cost
+            if cost:
+                elapsed = asyncio.get_running_loop().time() - started
+                self._seconds_per_unit = 0.8 * self._seconds_per_unit + 0.2 * elapsed / cost
+            self._wake()
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        return {
+            "budget": self.budget,
+            "in_flight_cost": self.in_flight,
+            "queued": self.queued,
+            "queued_cost": self.queued_cost,
+            "clients_waiting": len(self._queues),
+        }
@@ -0,0 +1,213 @@
+"""Benchmarks for the validation pipeline.
+
+Times detect_pdf_type, every validator and the whole /validate-documents
+request (through the FastAPI TestClient) on the synthetic corpus in
+fixtures.py, and writes latency percentiles, throughput and peak memory
+to JSON. Pass --baseline with an earlier output file to compare runs.
+For scanned fixtures, each --ocr-policies entry also gets an ocr/<policy>/
+case per document type with the share of runs that found every field, to
+show the speed/accuracy tradeoff between the OCR engines.
+
+    python -m benchmarks.bench --pages 1 5 --repeat 20 --output bench.json
+    python -m benchmarks.bench --baseline bench.json --fail-on-regression
+    python -m benchmarks.bench --variants scanned --ocr-policies easyocr tesseract fast-first
+
+The extraction cache is disabled unless --cache is given, so every run
+pays for parsing and OCR like a first upload does.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(samples, q: float) -> float:
+    # Nearest-rank percentile of an already sorted list
+    index = max(0, min(len(samples) - 1, int(round(q / 100 * len(samples) + 0.5)) - 1))
+    return samples[index]
+
+
+def summarize(samples, items: int, peak_bytes: int) -> dict:
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "runs": len(ordered),
+        "mean_ms": total / len(ordered) * 1000,
+        "min_ms": ordered[0] * 1000,
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p95_ms": percentile(ordered, 95) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+        "throughput_per_s": items * len(ordered) / total if total else 0.0,
+        "peak_alloc_kb": peak_bytes // 1024,
+    }
+
+
+def measure(fn, repeat: int, warmup: int = 1, items: int = 1) -> dict:
+    """Time `repeat` calls of fn, then one more under tracemalloc for peak memory."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return summarize(samples, items, peak)
+
+
+def run(args) -> dict:
+    from fastapi.testclient import TestClient
+
+    import main
+    from benchmarks.fixtures import FORM, corpus
+    from extraction import extract_document
+    from ingest import memory_usage
+    from ocr import engines_in_use, policy_engines
+    from utils import DOCUMENT_VALIDATIONS, detect_pdf_type, required_fields, uses_layout
+
+    meta = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "pages": args.pages,
+        "variants": args.variants,
+        "cache": args.cache,
+    }
+    policies = []
+    if "scanned" in args.variants:
+        # Model loading is a one-off; keep it out of the per-request numbers
+        for engine in engines_in_use():
+            engine.load()
+        for policy in args.ocr_policies:
+            try:
+                for engine in policy_engines(policy):
+                    engine.load()
+                policies.append(policy)
+            except Exception as e:
+                print(f"Skipping OCR policy {policy}: {e}", file=sys.stderr)
+        meta["ocr"] = {engine.name: engine.status() for engine in engines_in_use()}
+        meta["ocr_policies"] = policies
+
+    client = TestClient(main.app)
+    results = {}
+    for variant in args.variants:
+        for pages in args.pages:
+            files = corpus(variant, pages)
+            suffix = f"{variant}/{pages}p"
+
+            def detect_all():
+                for data in files.values():
+                    detect_pdf_type(data)
+
+            results[f"detect_pdf_type/{suffix}"] = measure(detect_all, args.repeat, items=len(files))
+
+            for name, (_, validator, kwargs) in DOCUMENT_VALIDATIONS.items():
+                data, arguments = files[name], kwargs(FORM)
+                results[f"{validator.__name__}/{suffix}"] = measure(
+                    lambda: validator(data, **arguments), args.repeat
+                )
+
+            def post_all():
+                response = client.post(
+                    "/validate-documents", data=FORM,
+                    files={name: (f"{name}.pdf", data, "application/pdf") for name, data in files.items()},
+                )
+                response.raise_for_status()
+
+            results[f"endpoint/{suffix}"] = measure(post_all, args.repeat)
+
+            for policy in policies if variant == "scanned" else ():
+                for name, (_, validator, kwargs) in DOCUMENT_VALIDATIONS.items():
+                    data, arguments = files[name], kwargs(FORM)
+                    until = required_fields(validator, arguments)
+                    found = []
+
+                    def read():
+                        document = extract_document(data, until=until, ocr_policy=policy, layout=uses_layout(validator))
+                        validator(document, **arguments)
+                        found.append(bool(until and until(document.text)))
+
+                    stats = measure(read, args.repeat)
+                    stats["fields_found"] = sum(found) / len(found)
+                    results[f"ocr/{policy}/{name}/{suffix}"] = stats
+            print(f"{suffix}: done", file=sys.stderr)
+
+    return {"meta": meta, "process": memory_usage(), "results": results}
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Print p50/p95 against the baseline; return the regressed cases."""
+    regressions = []
+    print(f"{'case':<55} {'p50 ms':>10} {'base':>10} {'change':>8} {'p95 ms':>10} {'base':>10}")
+    for case, stats in current["results"].items():
+        base = baseline.get("results", {}).get(case)
+        if base is None:
+            print(f"{case:<55} {stats['p50_ms']:>10.2f} {'-':>10} {'new':>8} {stats['p95_ms']:>10.2f} {'-':>10}")
+            continue
+        change = stats["p50_ms"] / base["p50_ms"] - 1 if base["p50_ms"] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(case)
+            flag = "  <-- slower"
+        print(
+            f"{case:<55} {stats['p50_ms']:>10.2f} {base['p50_ms']:>10.2f} {change:>+8.1%} "
+            f"{stats['p95_ms']:>10.2f} {base['p95_ms']:>10.2f}{flag}"
+        )
+    return regressions
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 5], help="page counts per fixture")
+    parser.add_argument("--variants", nargs="+", choices=["text", "scanned"], default=["text", "scanned"])
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs per case")
+    parser.add_argument("--cache", action="store_true", help="keep the extraction cache enabled")
+    parser.add_argument(
+        "--ocr-policies", nargs="*", default=["easyocr", "tesseract", "fast-first"],
+        help="OCR policies to compare on the scanned fixtures",
+    )
+    parser.add_argument("--output", default="bench.json", help="where to write the results")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="p50 slowdown counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    # Must be set before the cache module is imported
+    if not args.cache:
+        os.environ["CACHE_MAX_ENTRIES"] = "0"
+        os.environ.pop("CACHE_DB_PATH", None)
+        os.environ.pop("DOCUMENT_STORE_DIR", None)
+        os.environ["OCR_PAGE_HASH"] = "0"
+    os.environ.setdefault("OCR_WARMUP", "0")
+
+    current = run(args)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(current, json.load(f), args.threshold)
+    else:
+        compare(current, {}, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,110 @@
+"""Synthetic PDFs for the benchmarks: every document type as a text-layer
+PDF or as a scanned one (the same page rendered to an image), with the
+fields on the first page and filler text on the rest."""
+from datetime import date, timedelta
+
+import fitz  # PyMuPDF
+
+# Dates relative to today so the validators keep accepting the fixtures
+_TODAY = date.today()
+_ISSUED = (_TODAY - timedelta(days=14)).strftime("%d/%m/%Y")
+_NEXT_YEAR = _TODAY.year + 1
+
+FORM = dict(
+    businessAddress="Stationsstraat 1, 3600 Genk",
+    firstName="Jan",
+    lastName="Peeters",
+    ownerName="Piet Claes",
+    companyNumber="0123.456.789",
+    companyName="Genk Frituur BV",
+)
+
+DOCUMENT_LINES = {
+    "IDCardAttachment": [
+        "BELGIE  BELGIQUE  BELGIEN  BELGIUM",
+        "IDENTITEITSKAART  CARTE D'IDENTITE",
+        "Naam / Name: Peeters",
+        "Voornamen / Given names: Jan",
+        "Geboortedatum: 12.03.1985",
+        f"Geldig tot / Valid until: 01.01.{_TODAY.year + 5}",
+    ],
+    "KBORegisterExtract": [
+        "Kruispuntbank van Ondernemingen - Uittreksel",
+        "Ondernemingsnummer: 0123.456.789",
+        "Naam: Genk Frituur BV",
+        "Rechtsvorm: Besloten Vennootschap",
+        "Functies: Zaakvoerder Jan Peeters",
+        "Maatschappelijke zetel: Stationsstraat 1, 3600 Genk",
+    ],
+    "OfficialGazettePublication": [
+        "Bijlagen bij het Belgisch Staatsblad",
+        "Ondernemingsnr: 0123.456.789",
+        "Benaming: Genk Frituur BV",
+        "Rechtsvorm: Besloten Vennootschap",
+        "Voorwerp van de akte: Oprichting",
+    ],
+    "MoralityCertificate": [
+        "UITTREKSEL UIT HET STRAFREGISTER",
+        "Naam: Peeters  Voornaam: Jan",
+        f"Datum van afgifte: {_ISSUED}",
+        "Geen veroordelingen",
+    ],
+    "LiabilityInsuranceCopy": [
+        "Verzekeringsattest burgerlijke aansprakelijkheid",
+        "Verzekeringnemer: Genk Frituur BV",
+        "Polisnummer: 7788-12",
+        f"Periode: van 1 januari {_TODAY.year} tot 31 december {_NEXT_YEAR}",
+    ],
+    "CommercialLeaseAgreement": [
+        "HANDELSHUUROVEREENKOMST",
+        "Seller: Name: Piet Claes Address: Kerkstraat 5 VAT BE0999.888.777",
+        "The premises located at Stationsstraat 1, 3600 Genk the Buyer",
+        "Duur: negen jaar, ingaand op 1 februari 2026",
+    ],
+    "ElectricCertificate": [
+        "PROCES-VERBAAL VAN GELIJKVORMIGHEIDSONDERZOEK",
+        "Adres: Stationsstraat 1, 3600 Genk",
+        "Besluit: DE INSTALLATIE IS CONFORM",
+        "Datum van controle: 15/05/2025",
+    ],
+}
+
+FILLER = (
+    "Dit document bevat aanvullende bepalingen en voorwaarden die van toepassing zijn op de "
+    "bovenvermelde partijen. Artikel {page}.{line}: de partijen verbinden zich ertoe de "
+    "voorwaarden na te leven zoals overeengekomen."
+)
+
+VARIANTS = ("text", "scanned")
+SCAN_DPI = 150
+
+
+def _write_page(doc: fitz.Document, lines) -> None:
+    page = doc.new_page()
+    y = 72
+    for line in lines:
+        page.insert_text((56, y), line, fontsize=11)
+        y += 18
+
+
+def make_pdf(lines, pages: int = 1, scanned: bool = False) -> bytes:
+    """A PDF whose first page holds `lines`, followed by filler pages."""
+    doc = fitz.open()
+    _write_page(doc, lines)
+    for number in range(2, pages + 1):
+        _write_page(doc, [FILLER.format(page=number, line=i)[:90] for i in range(1, 30)])
+    if not scanned:
+        return doc.tobytes()
+
+    # Scanned copy: each page becomes one image with no text layer
+    scan = fitz.open()
+    for page in doc:
+        pix = page.get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY)
+        scan.new_page(width=page.rect.width, height=page.rect.height).insert_image(page.rect, pixmap=pix)
+    return scan.tobytes(deflate=True)
+
+
+def corpus(variant: str = "text", pages: int = 1) -> dict:
+    """One synthetic upload per document type, keyed by upload field."""
+    scanned = variant == "scanned"
+    return {name: make_pdf(lines, pages, scanned) for name, lines in DOCUMENT_LINES.items()}
@@ -0,0 +1,238 @@
+"""Validate many applicant dossiers in one run, streaming one NDJSON line per dossier.
+
+The manifest is a JSON list or NDJSON, one dossier per entry:
+
+    {"id": "applicant-17",
+     "form": {"businessAddress": "...", "firstName": "...", ...},
+     "files": {"IDCardAttachment": "17/id.pdf", "KBORegisterExtract": "sha256:<hash>", ...}}
+
+Files are members of the zip archive when one is given, otherwise paths
+relative to the manifest (CLI only); "sha256:<hash>" takes the document
+from the document store. Only the listed files are validated.
+
+    python -m bulk dossiers.ndjson --archive dossiers.zip --output results.ndjson
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import zipfile
+from typing import AsyncIterator, Dict, List, Optional
+
+from admission import estimate_cost
+from ingest import MAX_FILE_BYTES, IngestedFile, ingest_bytes, ingest_path
+from scheduler import DOCUMENT_TIMEOUT, ValidationScheduler
+from store import document_store
+from utils import DOCUMENT_VALIDATIONS, validation_jobs, validation_response
+
+
+# Dossiers validated in one scheduler pass; their scanned pages share OCR batches
+BULK_WAVE_DOSSIERS = int(os.getenv("BULK_WAVE_DOSSIERS", "8"))
+# Waves in flight, so the pools are not idle while one wave finishes
+BULK_CONCURRENT_WAVES = int(os.getenv("BULK_CONCURRENT_WAVES", "2"))
+BULK_MAX_DOSSIERS = int(os.getenv("BULK_MAX_DOSSIERS", "1000"))
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+def parse_manifest(data: bytes) -> List[dict]:
+    text = data.decode("utf-8").strip()
+    try:
+        if text.startswith("["):
+            entries = json.loads(text)
+        else:
+            entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Manifest is not JSON or NDJSON: {e}")
+    if len(entries) > BULK_MAX_DOSSIERS:
+        raise ValueError(f"Manifest lists more than {BULK_MAX_DOSSIERS} dossiers")
+    ids = set()
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not isinstance(entry.get("files"), dict):
+            raise ValueError(f"Manifest entry {index} has no files")
+        if not isinstance(entry.setdefault("form", {}), dict):
+            raise ValueError(f"Manifest entry {index} has no form")
+        entry["id"] = str(entry.get("id", index))
+        if entry["id"] in ids:
+            raise ValueError(f"Dossier id {entry['id']} appears twice in the manifest")
+        ids.add(entry["id"])
+    return entries
+
+
+class FileResolver:
+    """Turns the file references of a manifest into ingested files."""
+
+    def __init__(self, archive: Optional[zipfile.ZipFile] = None, base_dir: Optional[str] = None, store=None):
+        self.archive = archive
+        self.base_dir = base_dir
+        self.store = store
+
+    def resolve(self, name: str, reference: str) -> IngestedFile:
+        if reference.startswith("sha256:"):
+            ingested = self.store.open(reference[7:].lower()) if self.store is not None else None
+            if ingested is None:
+                raise ValueError(f"{name}: {reference} is not in the document store")
+            return ingested
+        if self.archive is not None:
+            try:
+                info = self.archive.getinfo(reference)
+            except KeyError:
+                raise ValueError(f"{name}: {reference} is not in the archive")
+            if info.file_size > MAX_FILE_BYTES:
+                raise ValueError(f"{name} exceeds {MAX_FILE_BYTES} bytes")
+            return ingest_bytes(name, self.archive.read(info))
+        if self.base_dir is not None:
+            return ingest_path(name, os.path.join(self.base_dir, reference))
+        raise ValueError(f"{name}: no archive to read {reference} from")
+
+    def dossier(self, entry: dict) -> Dict[str, IngestedFile]:
+        unknown = sorted(set(entry["files"]) - set(DOCUMENT_VALIDATIONS))
+        if unknown:
+            raise ValueError(f"Unknown document fields: {', '.join(unknown)}")
+        for name in entry["files"]:
+            try:
+                DOCUMENT_VALIDATIONS[name][2](entry["form"])
+            except KeyError as e:
+                raise ValueError(f"{name}: missing form field {e.args[0]}")
+        files = {}
+        try:
+            for name, reference in entry["files"].items():
+                files[name] = self.resolve(name, reference)
+        except Exception:
+            for ingested in files.values():
+                ingested.close()
+            raise
+        return files
+
+
+def _error(e: Exception) -> str:
+    # ingest raises HTTPException for oversized files
+    return str(getattr(e, "detail", None) or e)
+
+
+async def run_bulk(
+    entries: List[dict],
+    resolver: FileResolver,
+    scheduler: ValidationScheduler,
+    admission=None,
+    client: str = "bulk",
+) -> AsyncIterator[dict]:
+    """Yield one result per dossier as its wave finishes, then a summary.
+
+    Dossiers go through the scheduler BULK_WAVE_DOSSIERS at a time, so text
+    layers are read in parallel across dossiers and the scanned pages of a
+    whole wave share OCR batches.
+    """
+    started = time.perf_counter()
+    lines: "asyncio.Queue[Optional[dict]]" = asyncio.Queue()
+    slots = asyncio.Semaphore(BULK_CONCURRENT_WAVES)
+    failed = 0
+
+    async def wave(chunk: List[dict]) -> None:
+        nonlocal failed
+        async with slots:
+            dossiers: Dict[str, tuple] = {}
+            jobs = {}
+            for entry in chunk:
+                dossier = entry["id"]
+                try:
+                    files = await asyncio.to_thread(resolver.dossier, entry)
+                except Exception as e:
+                    failed += 1
+                    await lines.put({"id": dossier, "error": _error(e)})
+                    continue
+                dossiers[dossier] = (files, entry["form"])
+                for name, job in validation_jobs(files, entry["form"]).items():
+                    jobs[(dossier, name)] = job
+            try:
+                cost = sum(estimate_cost(files) for files, _ in dossiers.values())
+                timeout = None if DOCUMENT_TIMEOUT is None else DOCUMENT_TIMEOUT * max(1, len(dossiers))
+                if admission is not None:
+                    async with admission.admit(cost, client, shed=False):
+                        results, documents = await scheduler.run(jobs, timeout=timeout)
+                else:
+                    results, documents = await scheduler.run(jobs, timeout=timeout)
+                for dossier, (files, form) in dossiers.items():
+                    own_results = {name: results[(dossier, name)] for name in files if (dossier, name) in results}
+                    own_documents = {name: documents[(dossier, name)] for name in files if (dossier, name) in documents}
+                    if document_store is not None:
+                        own_jobs = {name: jobs[(dossier, name)] for name in own_results}
+                        await asyncio.to_thread(document_store.save_results, files, own_jobs, own_results)
+                    await lines.put({"id": dossier, **validation_response(own_results, own_documents)})
+            finally:
+                for files, _ in dossiers.values():
+                    for ingested in files.values():
+                        ingested.close()
+
+    async def produce() -> None:
+        try:
+            await asyncio.gather(*(
+                wave(entries[start:start + BULK_WAVE_DOSSIERS])
+                for start in range(0, len(entries), BULK_WAVE_DOSSIERS)
+            ))
+        finally:
+            await lines.put(None)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            line = await lines.get()
+            if line is None:
+                break
+            yield line
+        await producer  # re-raises a failed wave
+    finally:
+        producer.cancel()
+
+    seconds = time.perf_counter() - started
+    yield {"summary": {
+        "dossiers": len(entries),
+        "failed": failed,
+        "seconds": round(seconds, 3),
+        "dossiers_per_minute": round(len(entries) / seconds * 60, 2) if seconds else None,
+    }}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("manifest", help="JSON or NDJSON manifest of dossiers")
+    parser.add_argument("--archive", help="zip archive holding the files the manifest refers to")
+    parser.add_argument("--output", default="-", help="where to write the NDJSON results (default: stdout)")
+    args = parser.parse_args(argv)
+
+    with open(args.manifest, "rb") as f:
+        entries = parse_manifest(f.read())
+    archive = zipfile.ZipFile(args.archive) if args.archive else None
+    resolver = FileResolver(
+        archive=archive, base_dir=os.path.dirname(os.path.abspath(args.manifest)), store=document_store
+    )
+    scheduler = ValidationScheduler()
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+
+    async def run() -> dict:
+        summary = {}
+        async for line in run_bulk(entries, resolver, scheduler):
+            output.write(json.dumps(line) + "\n")
+            output.flush()
+            summary = line.get("summary", summary)
+        return summary
+
+    try:
+        summary = asyncio.run(run())
+    finally:
+        scheduler.shutdown()
+        if archive is not None:
+            archive.close()
+        if output is not sys.stdout:
+            output.close()
+    print(
+        f"{summary['dossiers']} dossiers ({summary['failed']} failed) in {summary['seconds']:.1f}s: "
+        f"{summary['dossiers_per_minute']} dossiers/minute",
+        file=sys.stderr,
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+from store import index_path
+
+
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "512"))
+# Optional on-disk tier; unset keeps the cache in memory only, unless the
+# document store is enabled, whose index then holds the extractions too
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH") or index_path()
+
+
+class ExtractionCache:
+    """Two-tier cache of extracted pages, keyed by content hash and OCR settings.
+
+    Values are plain dicts (see ExtractedDocument.to_dict). The memory tier is
+    an LRU bounded by entry count and by the approximate size of the stored
+    text; the optional SQLite tier keeps zlib-compressed JSON so results
+    survive restarts.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = CACHE_MAX_BYTES,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        db_path: Optional[str] = CACHE_DB_PATH,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS extractions (key TEXT PRIMARY KEY, value BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM extractions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    raw = zlib.decompress(row[0])
+                    value = json.loads(raw)
+                    self._remember(key, value, len(raw))
+                    self.hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: dict) -> None:
+        raw = json.dumps(value).encode("utf-8")
+        with self._lock:
+            self._remember(key, value, len(raw))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO extractions (key, value) VALUES (?, ?)",
+                    (key, zlib.compress(raw)),
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, value: dict, size: int) -> None:
+        # size is the length of the serialized value, a proxy for the text held
+        if key in self._entries:
+            self._size -= self._entries.pop(key)[1]
+        self._entries[key] = (value, size)
+        self._size += size
+        while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "persistent": self._db is not None,
+        }
+
+
+extraction_cache = ExtractionCache()
@@ -0,0 +1,604 @@
+import fitz  # PyMuPDF
+import hashlib
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set, Union
+
+import numpy as np
+
+from cache import extraction_cache
+from layout import LAYOUT_INDEX, ocr_words, text_words
+from metrics import ocr_pages, pages_parsed, span
+from ocr import OCR_ENGINES, RENDER_DPI, ocr_policy as default_ocr_policy, policy_engines
+from page_hash import OCR_PAGE_HASH, PageHashIndex, page_digest
+from preprocess import preprocessor
+
+
+# Bumped whenever page classification changes, so stale cache entries are ignored
+EXTRACTION_VERSION = 6
+
+# Page classification thresholds
+MIN_GLYPHS = int(os.getenv("PAGE_MIN_GLYPHS", "20"))
+MIN_IMAGE_RATIO = float(os.getenv("PAGE_MIN_IMAGE_RATIO", "0.05"))
+
+# Stop reading text layers once the validator's fields are all found (see extract_document)
+PAGE_EARLY_EXIT = os.getenv("PAGE_EARLY_EXIT", "1") == "1"
+# Most pages read per upload field, e.g. "OfficialGazettePublication=10,KBORegisterExtract=3";
+# other fields fall back to MAX_DOCUMENT_PAGES (0: every page)
+MAX_DOCUMENT_PAGES = int(os.getenv("MAX_DOCUMENT_PAGES", "0"))
+PAGE_BUDGETS = {
+    name: int(pages)
+    for name, pages in (
+        item.split("=", 1) for item in os.getenv("PAGE_BUDGETS", "").replace(" ", "").split(",") if "=" in item
+    )
+}
+
+
+# Raw PDF bytes, or an object with .open() -> fitz.Document and a .sha256
+# attribute such as ingest.IngestedFile
+Source = Union[bytes, Any]
+
+
+def open_pdf(source: Source) -> "fitz.Document":
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open("pdf", source)
+    return source.open()
+
+
+@dataclass
+class ExtractedPage:
+    number: int
+    has_text: bool
+    image_count: int
+    text: str = ""
+    # "text": text layer only, "image": OCR the whole page, "mixed": text layer
+    # plus OCR of ocr_regions, "empty": nothing to read
+    kind: str = "text"
+    glyphs: int = 0
+    text_coverage: float = 0.0
+    image_ratio: float = 0.0
+    ocr_regions: List[List[float]] = field(default_factory=list)
+    ocr_results: Optional[List[str]] = None
+    # Engine that read (or is to read) the page; set when falling back to the next one
+    ocr_engine: Optional[str] = None
+    # Set while OCR of the page is incomplete, e.g. after an early stop
+    ocr_partial: bool = False
+    render_seconds: Optional[float] = None
+    ocr_seconds: Optional[float] = None
+    # [x0, y0, x1, y1, text, frame] per word, kept for documents read with layout=True (see layout.py)
+    words: Optional[List[list]] = None
+
+    @property
+    def page_type(self) -> str:
+        if self.has_text:
+            return "text"
+        if self.image_count:
+            return "image"
+        return "empty"
+
+    @property
+    def needs_ocr(self) -> bool:
+        return self.kind in ("image", "mixed") and (self.ocr_results is None or self.ocr_partial)
+
+    @property
+    def content(self) -> str:
+        return self.content_with(self.ocr_results)
+
+    def content_with(self, ocr_results: Optional[List[str]]) -> str:
+        # OCR text ends with a newline, like a text layer, so pages do not run together
+        if self.kind == "image":
+            return " ".join(ocr_results or []) + "\n"
+        if self.kind == "mixed":
+            return self.text + " ".join(ocr_results or []) + "\n"
+        return self.text
+
+
+@dataclass
+class ExtractedDocument:
+    """Everything the validators need from one upload, extracted in a single pass.
+
+    The PDF is opened once: the text layer of each page is read and the
+    page is classified, in order, until the validator's fields are found or
+    the page budget is used up. Only pages (or image regions) without a
+    usable text layer are OCR'd, either right away or later in a batch
+    together with other documents, by the engines of the document's OCR
+    policy.
+    """
+    # The pages read so far, from the first one on; see page_count
+    pages: List[ExtractedPage] = field(default_factory=list)
+    page_count: int = 0
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    # OCR inference calls this document took part in: {"pages": n, "seconds": t}
+    ocr_batches: List[dict] = field(default_factory=list)
+    sha256: Optional[str] = None
+    cached: bool = False
+    # Kept so OCR can run later on a different executor (see ocr_document)
+    source: Optional[Source] = field(default=None, repr=False, compare=False)
+    # Accepts the document text once every field a validator needs is present;
+    # when it has .checks, one per field, all of them must accept (see _parse)
+    until: Optional[Callable[[str], bool]] = field(default=None, repr=False, compare=False)
+    # See ocr.POLICIES
+    ocr_policy: str = field(default_factory=default_ocr_policy, compare=False)
+    # Keep the word boxes of every page, for validators that look values up by label
+    layout: bool = field(default=False, compare=False)
+    # OCR text of identical pages is only shared within one scope, e.g. a dossier (see page_hash.py)
+    scope: Optional[str] = field(default=None, compare=False)
+
+    @property
+    def ocr_engines(self) -> List[str]:
+        return [engine.name for engine in policy_engines(self.ocr_policy)]
+
+    @property
+    def cache_key(self) -> str:
+        # The OCR output depends on the engines, their models, raster resolution and preprocessing
+        engines = "+".join(engine.cache_tag for engine in policy_engines(self.ocr_policy))
+        key = f"{self.sha256}:v{EXTRACTION_VERSION}:{self.ocr_policy}:{engines}:{preprocessor.cache_tag}"
+        return f"{key}:layout" if self.layout else key
+
+    def to_dict(self) -> dict:
+        return {"pages": [asdict(page) for page in self.pages], "page_count": self.page_count}
+
+    @classmethod
+    def from_dict(cls, data: dict, **kwargs) -> "ExtractedDocument":
+        pages = [ExtractedPage(**page) for page in data["pages"]]
+        return cls(pages=pages, page_count=data.get("page_count", len(pages)), **kwargs)
+
+    def page_limit(self, max_pages: Optional[int] = None) -> int:
+        return min(self.page_count, max_pages) if max_pages else self.page_count
+
+    @property
+    def examined_pages(self) -> List[int]:
+        """1-based numbers of the pages whose content was read, fully or up to an early stop."""
+        return [
+            page.number + 1 for page in self.pages
+            if page.kind in ("text", "empty") or page.ocr_results is not None
+        ]
+
+    @property
+    def needs_ocr(self) -> bool:
+        return self.error is None and any(page.needs_ocr for page in self.pages)
+
+    @property
+    def satisfied(self) -> bool:
+        return self.until is not None and self.until(self.text)
+
+    @property
+    def pdf_type(self) -> str:
+        """'text', 'image', 'empty' or 'unreadable', decided by the first non-empty page."""
+        if self.error is not None:
+            return "unreadable"
+        for page in self.pages:
+            if page.page_type != "empty":
+                return page.page_type
+        return "empty"
+
+    @property
+    def text(self) -> str:
+        return "".join(page.content for page in self.pages)
+
+
+def _area(rect) -> float:
+    return max(0.0, rect.x1 - rect.x0) * max(0.0, rect.y1 - rect.y0)
+
+
+def classify_page(page, text: str) -> ExtractedPage:
+    """Decide from the text layer and the placed images how a page must be read.
+
+    A page with enough glyphs is read from its text layer. Images that cover
+    a meaningful share of the page and are not overlaid by text become OCR
+    regions; a page with too few glyphs is OCR'd as a whole. An image counts
+    as overlaid once the words placed over it hold MIN_GLYPHS glyphs, however
+    little of it they cover: scans that already carry an invisible OCR layer
+    often have only a few lines of text on a full-page image.
+    """
+    page_rect = page.rect
+    page_area = _area(page_rect) or 1.0
+    glyphs = len("".join(text.split()))
+    extracted = ExtractedPage(
+        number=page.number,
+        has_text=bool(text.strip()),
+        image_count=len(page.get_images(full=True)),
+        text=text,
+        glyphs=glyphs,
+    )
+    if not extracted.image_count:
+        extracted.kind = "text" if glyphs else "empty"
+        return extracted
+
+    text_blocks = [fitz.Rect(block[:4]) for block in page.get_text("blocks") if block[6] == 0] if glyphs else []
+    extracted.text_coverage = min(1.0, sum(_area(rect) for rect in text_blocks) / page_area)
+    # (centre, glyphs) per word of the text layer
+    words = [
+        (fitz.Point((word[0] + word[2]) / 2, (word[1] + word[3]) / 2), len(word[4]))
+        for word in page.get_text("words")
+    ] if glyphs else []
+
+    regions = []
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"]) & page_rect
+        area = _area(bbox)
+        if area / page_area < MIN_IMAGE_RATIO:
+            continue  # logos, stamps, signatures
+        extracted.image_ratio += area / page_area
+        overlaid = sum(count for centre, count in words if centre in bbox)
+        if overlaid < MIN_GLYPHS:
+            regions.append(bbox)
+    extracted.image_ratio = min(1.0, extracted.image_ratio)
+
+    if glyphs < MIN_GLYPHS:
+        extracted.kind = "image" if extracted.image_ratio or not glyphs else "text"
+    elif regions:
+        extracted.kind = "mixed"
+        extracted.ocr_regions = [list(region) for region in regions]
+    else:
+        extracted.kind = "text"
+    return extracted
+
+
+def render_page(page, dpi: int = RENDER_DPI, clip=None, gray: bool = False) -> np.ndarray:
+    """Rasterize a page (or a clip of it) straight into an RGB or grey array, without any image encoding."""
+    with span("render"):
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY if gray else fitz.csRGB, alpha=False, clip=clip)
+    samples = np.frombuffer(pix.samples, dtype=np.uint8)
+    if gray:
+        return samples.reshape(pix.height, pix.width)
+    return samples.reshape(pix.height, pix.width, pix.n)
+
+
+def _page_hash_tag(engine) -> str:
+    return f"{engine.name}:{engine.cache_tag}:{preprocessor.cache_tag}"
+
+
+def _prepare(document: ExtractedDocument, page, engine, clip=None) -> np.ndarray:
+    image = render_page(page, dpi=engine.render_dpi, clip=clip, gray=preprocessor.grayscale)
+    started = time.perf_counter()
+    image = preprocessor(image)
+    document.timings["preprocess"] = document.timings.get("preprocess", 0.0) + time.perf_counter() - started
+    return image
+
+
+def _add_words(document: ExtractedDocument, extracted: ExtractedPage, texts, locations, frame: int) -> None:
+    if document.layout and locations:
+        extracted.words = (extracted.words or []) + ocr_words(texts, locations, frame)
+
+
+def _render_next(
+    document: ExtractedDocument, doc, work: Dict[str, tuple], page_hashes: Optional[PageHashIndex]
+) -> None:
+    """Render the pages this round of OCR should read, at their engine's resolution.
+
+    Documents that can stop early (document.until is set) advance one page
+    per round; the others send every pending page at once. work maps an
+    engine name to the (images, targets) it will read. A whole page identical
+    to one read before in this OCR pass gets that page's text instead.
+    """
+    started = time.perf_counter()
+    pages = [extracted for extracted in document.pages if extracted.needs_ocr]
+    if document.until is not None:
+        pages = pages[:1]
+    for extracted in pages:
+        page_started = time.perf_counter()
+        extracted.ocr_engine = extracted.ocr_engine or document.ocr_engines[0]
+        engine = OCR_ENGINES[extracted.ocr_engine]
+        page = doc[extracted.number]
+        extracted.ocr_seconds = 0.0
+        if extracted.words is not None:
+            # Words of an earlier, partial or failed read; frame 0 is the text layer
+            extracted.words = [word for word in extracted.words if word[5] == 0]
+        if extracted.kind == "mixed":
+            clips = [fitz.Rect(region) for region in extracted.ocr_regions]
+            rasters = [(_prepare(document, page, engine, clip), None) for clip in clips]
+        else:
+            image = _prepare(document, page, engine)
+            page_hash = page_digest(image) if page_hashes is not None else None
+            found = (
+                page_hashes.lookup(document.scope, page_hash, _page_hash_tag(engine), count_miss=False)
+                if page_hash is not None else None
+            )
+            if found is not None:
+                extracted.ocr_results, locations = found
+                _add_words(document, extracted, extracted.ocr_results, locations, 1)
+                extracted.ocr_partial = False
+                extracted.render_seconds = time.perf_counter() - page_started
+                continue
+            rasters = [(image, page_hash)]
+        images, targets = work.setdefault(engine.name, ([], []))
+        for image, page_hash in rasters:
+            images.append(image)
+            targets.append((document, extracted, page_hash))
+        ocr_pages.inc(engine=engine.name)
+        extracted.ocr_results = []
+        extracted.ocr_partial = True
+        extracted.render_seconds = time.perf_counter() - page_started
+    document.timings["render"] = document.timings.get("render", 0.0) + time.perf_counter() - started
+
+
+def _until(document: ExtractedDocument, extracted: ExtractedPage) -> Callable[[List[str]], bool]:
+    """document.until for the text with texts read so far on this page, in page order."""
+    before = "".join(page.content for page in document.pages[:extracted.number])
+    after = "".join(page.content for page in document.pages[extracted.number + 1:])
+    read = list(extracted.ocr_results)
+    return lambda texts: document.until(before + extracted.content_with(read + texts) + after)
+
+
+def _detect(engine, images: list, targets: list):
+    """Detector boxes of every raster, and the detector calls.
+
+    When a batch fails, the rasters are detected one by one so that only
+    the documents of the rasters that fail get an error.
+    """
+    try:
+        return engine.detect_batched(images)
+    except Exception as e:
+        if len(images) == 1:
+            targets[0][0].error = str(e)
+            return [None], []
+    boxes, batches = [None] * len(images), []
+    for index, image in enumerate(images):
+        try:
+            found, calls = engine.detect_batched([image])
+        except Exception as e:
+            targets[index][0].error = str(e)
+            continue
+        boxes[index] = found[0]
+        for batch in calls:
+            batches.append({**batch, "indexes": [index]})
+    return boxes, batches
+
+
+def _recognize(
+    engine, images: list, targets: list, halted: Set[int], page_hashes: Optional[PageHashIndex]
+) -> List[dict]:
+    """OCR one engine's rasters; pages stopped early are added to halted.
+
+    A raster that cannot be read sets the error of its document only.
+    """
+    if not images:
+        return []
+    if engine.detect_stage:
+        with span(engine.detect_stage):
+            boxes, batches = _detect(engine, images, targets)
+    else:
+        boxes, batches = _detect(engine, images, targets)
+    for batch in batches:
+        # Pages in one detector call share its cost evenly
+        share = batch["seconds"] / len(batch["indexes"])
+        involved = {}
+        for index in batch["indexes"]:
+            document, extracted, _ = targets[index]
+            extracted.ocr_seconds += share
+            document.timings["ocr"] = document.timings.get("ocr", 0.0) + share
+            involved[id(document)] = document
+        batch["pages"] = len(batch.pop("indexes"))
+        batch["engine"] = engine.name
+        for document in involved.values():
+            document.ocr_batches.append(batch)
+
+    stopped = set()
+    frames: Dict[int, int] = {}
+    tag = _page_hash_tag(engine)
+    for index, (document, extracted, page_hash) in enumerate(targets):
+        # Every raster of a page (the whole page, or each region) has its own coordinates
+        frames[id(extracted)] = frames.get(id(extracted), 0) + 1
+        if id(document) in stopped or document.error is not None:
+            continue
+        until = _until(document, extracted) if document.until is not None else None
+        started = time.perf_counter()
+        # A page repeated within this batch is read once
+        found = page_hashes.lookup(document.scope, page_hash, tag) if page_hash is not None else None
+        if found is not None:
+            (texts, locations), complete = found, True
+        else:
+            try:
+                with span(engine.recognize_stage):
+                    texts, complete, locations = engine.recognize(images[index], boxes[index], until=until)
+            except Exception as e:
+                document.error = str(e)
+                continue
+            if page_hash is not None and complete:
+                page_hashes.add(document.scope, page_hash, tag, texts, locations)
+        seconds = time.perf_counter() - started
+        extracted.ocr_results.extend(texts)
+        _add_words(document, extracted, texts, locations, frames[id(extracted)])
+        extracted.ocr_seconds += seconds
+        document.timings["ocr"] = document.timings.get("ocr", 0.0) + seconds
+
+        last_region = index + 1 == len(targets) or targets[index + 1][1] is not extracted
+        if not complete or (until is not None and document.satisfied):
+            # Every field is found: skip the rest of this page and the later ones
+            stopped.add(id(document))
+            extracted.ocr_partial = not (complete and last_region)
+            if extracted.ocr_partial:
+                halted.add(id(extracted))
+        elif last_region:
+            extracted.ocr_partial = False
+    return batches
+
+
+def _fall_back(document: ExtractedDocument) -> None:
+    """Hand pages to the next engine of the policy when the previous one missed.
+
+    Once every page has been read: with required fields (document.until),
+    all OCR'd pages are read again if the fields are still missing; without,
+    only the pages where the engine found almost no text.
+    """
+    if document.error is not None or document.needs_ocr or document.satisfied:
+        return
+    engines = document.ocr_engines
+    for extracted in document.pages:
+        if extracted.ocr_engine not in engines[:-1]:
+            continue
+        if document.until is None:
+            glyphs = len("".join("".join(extracted.ocr_results or []).split()))
+            if glyphs >= MIN_GLYPHS:
+                continue
+        extracted.ocr_engine = engines[engines.index(extracted.ocr_engine) + 1]
+        extracted.ocr_results = None
+        extracted.ocr_partial = False
+
+
+def _ocr(documents: List[ExtractedDocument], opened: Dict[int, "fitz.Document"]) -> List[dict]:
+    batches = []
+    # Pages whose OCR stopped early are not read again in this call, even if
+    # the fields turn out to be missing after all: reading them again would
+    # stop at the same place
+    halted: Set[int] = set()
+    # Identical pages are read once per call, i.e. per request
+    page_hashes = PageHashIndex() if OCR_PAGE_HASH else None
+
+    def resumable(document: ExtractedDocument) -> bool:
+        return (
+            document.needs_ocr and not document.satisfied
+            and not any(page.needs_ocr and id(page) in halted for page in document.pages)
+        )
+
+    pending = [document for document in documents if resumable(document)]
+    while pending:
+        work: Dict[str, tuple] = {}
+        for document in pending:
+            try:
+                if id(document) not in opened:
+                    opened[id(document)] = open_pdf(document.source)
+                _render_next(document, opened[id(document)], work, page_hashes)
+            except Exception as e:
+                document.error = str(e)
+        for name, (images, targets) in work.items():
+            batches += _recognize(OCR_ENGINES[name], images, targets, halted, page_hashes)
+        for document in pending:
+            _fall_back(document)
+        pending = [document for document in pending if resumable(document)]
+    return batches
+
+
+def ocr_documents(documents: List[ExtractedDocument]) -> List[dict]:
+    """OCR the image pages of several documents in shared batches.
+
+    Each PDF is opened once to render its pages and the rasters of all
+    documents go through the detector together; recognition stops per
+    document as soon as its required fields are found. Returns the
+    per-batch timings.
+    """
+    pending = [document for document in documents if document.needs_ocr and not document.satisfied]
+    opened = {}
+    try:
+        batches = _ocr(pending, opened)
+    finally:
+        for doc in opened.values():
+            doc.close()
+    for document in pending:
+        _store(document)
+    return batches
+
+
+def _store(document: ExtractedDocument) -> None:
+    # Pages skipped by early termination stay pending in the cache and are
+    # read on a later request that needs them; failures are retried next time
+    if document.error is None:
+        extraction_cache.put(document.cache_key, document.to_dict())
+
+
+def page_budget(name: Optional[str] = None) -> Optional[int]:
+    """The most pages to read of an upload field, or None for all of them."""
+    return PAGE_BUDGETS.get(name, MAX_DOCUMENT_PAGES) or None
+
+
+def _parse(document: ExtractedDocument, doc, max_pages: Optional[int]) -> None:
+    # Carries on after the pages already read, e.g. by an earlier request that stopped early
+    document.page_count = doc.page_count
+    # Fields still missing are checked against each new page and the one
+    # before it (a value may run over the page break), not the whole text so
+    # far; the whole text is only checked once they are all found. A field
+    # spread over more pages is missed here and every page is read.
+    missing = list(getattr(document.until, "checks", ()))
+    if missing and document.pages:
+        text = document.text
+        missing = [check for check in missing if not check(text)]
+    with span("parse"):
+        for number in range(len(document.pages), document.page_limit(max_pages)):
+            page = doc[number]
+            if document.layout:
+                # Text and word boxes from one pass over the page's content
+                textpage = page.get_textpage()
+                extracted = classify_page(page, page.get_text(textpage=textpage))
+                extracted.words = text_words(page.get_text("words", textpage=textpage))
+            else:
+                extracted = classify_page(page, page.get_text())
+            document.pages.append(extracted)
+            pages_parsed.inc(kind=extracted.kind)
+            # Pages with nothing to read cannot complete a field; an image page
+            # is still checked, for checks that only need a page to be there
+            if not PAGE_EARLY_EXIT or extracted.page_type == "empty" or document.until is None:
+                continue
+            if missing:
+                window = "".join(page.content for page in document.pages[-2:])
+                missing = [check for check in missing if not check(window)]
+                if missing:
+                    continue
+            if document.satisfied:
+                break
+
+
+def extract_document(
+    source: Source,
+    ocr: bool = True,
+    until: Optional[Callable[[str], bool]] = None,
+    ocr_policy: Optional[str] = None,
+    max_pages: Optional[int] = None,
+    layout: bool = False,
+) -> ExtractedDocument:
+    """Read the text layers page by page; OCR scanned pages unless ocr=False.
+
+    With ocr=False the document can be finished later with ocr_document().
+    until, when given, lets reading stop once it accepts the document text:
+    text layers after the page that completes it are not parsed and OCR
+    stops early. At most max_pages pages are read. ocr_policy picks the OCR
+    engines (default: OCR_POLICY). Results are cached by content hash, so a
+    resubmitted file skips both steps; pages a cached entry has not read yet
+    are read when a later request needs them. layout=True also keeps the
+    word boxes of every page, for layout.document_layout().
+    """
+    started = time.perf_counter()
+    sha256 = getattr(source, "sha256", None) or hashlib.sha256(source).hexdigest()
+    policy = ocr_policy or default_ocr_policy()
+    layout = layout and LAYOUT_INDEX
+    document = ExtractedDocument(source=source, sha256=sha256, until=until, ocr_policy=policy, layout=layout)
+    cached = extraction_cache.get(document.cache_key)
+    if cached is not None:
+        document = ExtractedDocument.from_dict(
+            cached, sha256=sha256, cached=True, source=source, until=until, ocr_policy=policy, layout=layout
+        )
+        # Pages read for a larger budget are not looked at
+        del document.pages[document.page_limit(max_pages):]
+    if cached is None or (len(document.pages) < document.page_limit(max_pages) and not document.satisfied):
+        # New, or cached before the pages this request needs were read
+        try:
+            with open_pdf(source) as doc:
+                _parse(document, doc, max_pages)
+                document.timings["text"] = time.perf_counter() - started
+
+                # Only pages without a usable text layer go to OCR
+                if ocr and document.needs_ocr:
+                    _ocr([document], {id(document): doc})
+        except Exception as e:
+            document.error = str(e)
+        _store(document)
+
+    if ocr:
+        ocr_document(document)
+    document.timings["total"] = time.perf_counter() - started
+    return document
+
+
+def ocr_document(document: ExtractedDocument) -> ExtractedDocument:
+    """Run the OCR stage on a document extracted with ocr=False."""
+    if document.needs_ocr and not document.satisfied:
+        ocr_documents([document])
+    return document
+
+
+def as_document(source: Union[Source, ExtractedDocument], ocr: bool = True, layout: bool = False) -> ExtractedDocument:
+    if isinstance(source, ExtractedDocument):
+        return ocr_document(source) if ocr else source
+    return extract_document(source, ocr=ocr, layout=layout)
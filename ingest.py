@@ -0,0 +1,231 @@
+import fitz  # PyMuPDF
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+MAX_FILE_BYTES = int(os.getenv("MAX_FILE_BYTES", str(20 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(60 * 1024 * 1024)))
+MAX_FILE_PAGES = int(os.getenv("MAX_FILE_PAGES", "50"))
+MAX_REQUEST_PAGES = int(os.getenv("MAX_REQUEST_PAGES", "150"))
+# Uploads up to this size stay in memory; larger ones are written to a temp file
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(2 * 1024 * 1024)))
+
+
+class IngestedFile:
+    """An upload read once, in chunks: hashed on the way in, kept in memory
+    when small and on disk otherwise, so large PDFs never exist as bytes."""
+
+    def __init__(self, name: str, sha256: str, size: int, data: Optional[bytes] = None, path: Optional[str] = None):
+        self.name = name
+        self.sha256 = sha256
+        self.size = size
+        self.data = data
+        self.path = path
+        self.page_count = 0
+        # Pages without a text layer; they will need OCR
+        self.image_pages = 0
+        # Set for files owned by someone else (see store.DocumentStore), which close() leaves alone
+        self.keep = False
+
+    def open(self) -> fitz.Document:
+        if self.path is not None:
+            return fitz.open(self.path, filetype="pdf")
+        return fitz.open("pdf", self.data)
+
+    def read(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def persist(self, path: str) -> None:
+        """Move the upload to `path` so it outlives the request."""
+        if self.path is not None:
+            shutil.move(self.path, path)
+        else:
+            with open(path, "wb") as f:
+                f.write(self.data)
+        self.path = path
+        self.data = None
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "sha256": self.sha256, "size": self.size,
+                "path": self.path, "page_count": self.page_count, "image_pages": self.image_pages, "keep": self.keep}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "IngestedFile":
+        ingested = cls(data["name"], data["sha256"], data["size"], path=data["path"])
+        ingested.page_count = data.get("page_count", 0)
+        ingested.image_pages = data.get("image_pages", 0)
+        ingested.keep = data.get("keep", False)
+        return ingested
+
+    def close(self) -> None:
+        if self.path is not None and not self.keep and os.path.exists(self.path):
+            os.remove(self.path)
+        self.data = None
+
+
+class RequestBudget:
+    """Byte and page allowance shared by all uploads of one request."""
+
+    def __init__(self, max_bytes: int = MAX_REQUEST_BYTES, max_pages: int = MAX_REQUEST_PAGES):
+        self.bytes_left = max_bytes
+        self.pages_left = max_pages
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+
+    def consume_bytes(self, count: int) -> None:
+        self.bytes_left -= count
+        if self.bytes_left < 0:
+            raise HTTPException(status_code=413, detail=f"Uploads exceed {self.max_bytes} bytes in total")
+
+    def consume_pages(self, count: int) -> None:
+        self.pages_left -= count
+        if self.pages_left < 0:
+            raise HTTPException(status_code=413, detail=f"Uploads exceed {self.max_pages} pages in total")
+
+
+async def ingest_upload(name: str, upload: UploadFile, budget: RequestBudget) -> IngestedFile:
+    digest = hashlib.sha256()
+    size = 0
+    chunks = []
+    spill = None
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_FILE_BYTES:
+                raise HTTPException(status_code=413, detail=f"{name} exceeds {MAX_FILE_BYTES} bytes")
+            budget.consume_bytes(len(chunk))
+            digest.update(chunk)
+
+            if spill is None and size > SPOOL_MAX_BYTES:
+                spill = tempfile.NamedTemporaryFile(prefix="upload-", suffix=".pdf", delete=False)
+                spill.writelines(chunks)
+                chunks = []
+            if spill is not None:
+                spill.write(chunk)
+            else:
+                chunks.append(chunk)
+    except BaseException:
+        if spill is not None:
+            spill.close()
+            os.remove(spill.name)
+        raise
+
+    if spill is not None:
+        spill.close()
+        ingested = IngestedFile(name, digest.hexdigest(), size, path=spill.name)
+    else:
+        ingested = IngestedFile(name, digest.hexdigest(), size, data=b"".join(chunks))
+    _count_pages(ingested, budget)
+    return ingested
+
+
+def ingest_bytes(name: str, data: bytes, budget: Optional[RequestBudget] = None) -> IngestedFile:
+    """Like ingest_upload, for a file that is already in memory (e.g. a zip member)."""
+    if len(data) > MAX_FILE_BYTES:
+        raise HTTPException(status_code=413, detail=f"{name} exceeds {MAX_FILE_BYTES} bytes")
+    if budget is not None:
+        budget.consume_bytes(len(data))
+    ingested = IngestedFile(name, hashlib.sha256(data).hexdigest(), len(data), data=data)
+    _count_pages(ingested, budget)
+    return ingested
+
+
+def ingest_path(name: str, path: str) -> IngestedFile:
+    """A local file used in place: hashed in chunks, never copied, and not deleted on close()."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    ingested = IngestedFile(name, digest.hexdigest(), os.path.getsize(path), path=path)
+    ingested.keep = True
+    _count_pages(ingested, None)
+    return ingested
+
+
+def _count_pages(ingested: IngestedFile, budget: Optional[RequestBudget]) -> None:
+    name = ingested.name
+    # Counting pages only parses the xref; unreadable files are reported by the validators
+    try:
+        with ingested.open() as doc:
+            ingested.page_count = doc.page_count
+            if ingested.page_count <= MAX_FILE_PAGES:
+                # Font lists come from the page resources; no content stream is parsed
+                ingested.image_pages = sum(1 for number in range(doc.page_count) if not doc.get_page_fonts(number))
+    except Exception:
+        ingested.page_count = 0
+        ingested.image_pages = 0
+    try:
+        if ingested.page_count > MAX_FILE_PAGES:
+            raise HTTPException(status_code=413, detail=f"{name} exceeds {MAX_FILE_PAGES} pages")
+        if budget is not None:
+            budget.consume_pages(ingested.page_count)
+    except HTTPException:
+        ingested.close()
+        raise
+
+
+class RequestSizeLimitMiddleware:
+    """Rejects request bodies over max_bytes while they stream in, before
+    the multipart parser has spooled the uploads. limits overrides
+    max_bytes for individual paths."""
+
+    def __init__(self, app, max_bytes: int = MAX_REQUEST_BYTES, limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limits = limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.limits.get(scope.get("path"), self.max_bytes)
+        too_large = HTTPException(status_code=413, detail=f"Request body exceeds {max_bytes} bytes")
+        for key, value in scope.get("headers", []):
+            if key == b"content-length" and value.isdigit() and int(value) > max_bytes:
+                # Answer before reading anything; the route's exception handling is not involved
+                await send({"type": "http.response.start", "status": 413,
+                            "headers": [(b"content-type", b"application/json")]})
+                await send({"type": "http.response.body",
+                            "body": b'{"detail":"' + too_large.detail.encode() + b'"}'})
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise too_large
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def memory_usage() -> dict:
+    """Current and peak resident set size of this process, in kB (Linux only)."""
+    usage = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    usage["rss_kb"] = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    usage["peak_rss_kb"] = int(line.split()[1])
+    except OSError:
+        pass
+    return usage
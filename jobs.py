@@ -0,0 +1,301 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import urllib.request
+import uuid
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from admission import AdmissionController, estimate_cost
+from ingest import IngestedFile
+from store import DocumentStore
+from scheduler import ValidationScheduler
+from utils import DOCUMENT_VALIDATIONS, validation_jobs, validation_response
+
+
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.sqlite3")
+# Uploads of unfinished jobs live here so a restarted machine can resume them
+JOB_DIR = os.getenv("JOB_DIR", os.path.join(os.getcwd(), "job_uploads"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_CALLBACK_HOSTS = {
+    host.strip() for host in os.getenv("JOB_CALLBACK_HOSTS", "localhost,127.0.0.1,::1").split(",") if host.strip()
+}
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+
+UNFINISHED = ("pending", "running")
+
+# Jobs belong to the process running them: "<launch>:<pid>". serve.py gives all
+# workers of one start the same JOB_LAUNCH; a single process makes its own
+JOB_LAUNCH = os.getenv("JOB_LAUNCH") or uuid.uuid4().hex
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def orphaned(owner: Optional[str]) -> bool:
+    """Whether the process that owned a job is gone: an earlier start, or a worker that died."""
+    if not owner:
+        return True
+    launch, _, pid = owner.rpartition(":")
+    return launch != JOB_LAUNCH or not pid.isdigit() or not _alive(int(pid))
+
+
+class InMemoryJobStore:
+    """Job records in a dict; lost on restart."""
+
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: dict) -> None:
+        with self._lock:
+            self._jobs[job["id"]] = json.loads(json.dumps(job))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job is not None else None
+
+    def update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            self._jobs[job_id].update(fields, updated=time.time())
+
+    def set_result(self, job_id: str, name: str, result: dict) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            job["results"][name] = result
+            job["updated"] = time.time()
+
+    def unfinished(self) -> List[dict]:
+        with self._lock:
+            return [json.loads(json.dumps(job)) for job in self._jobs.values() if job["status"] in UNFINISHED]
+
+    def claim(self, job_id: str, previous: Optional[str], owner: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] not in UNFINISHED or job.get("owner") != previous:
+                return False
+            job.update(owner=owner, updated=time.time())
+            return True
+
+
+class SQLiteJobStore:
+    """Job records in SQLite, one JSON document per job, so they survive restarts."""
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, data TEXT NOT NULL, owner TEXT)"
+        )
+        if "owner" not in {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def _save(self, job: dict) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO jobs (id, status, data, owner) VALUES (?, ?, ?, ?)",
+            (job["id"], job["status"], json.dumps(job), job.get("owner")),
+        )
+        self._db.commit()
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def create(self, job: dict) -> None:
+        with self._lock:
+            self._save(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._load(job_id)
+
+    def update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            job = self._load(job_id)
+            job.update(fields, updated=time.time())
+            self._save(job)
+
+    def set_result(self, job_id: str, name: str, result: dict) -> None:
+        with self._lock:
+            job = self._load(job_id)
+            job["results"][name] = result
+            job["updated"] = time.time()
+            self._save(job)
+
+    def unfinished(self) -> List[dict]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT data FROM jobs WHERE status IN (?, ?)", UNFINISHED
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def claim(self, job_id: str, previous: Optional[str], owner: str) -> bool:
+        """Take over an unfinished job, unless another process has already.
+
+        The conditional UPDATE is atomic across the processes sharing the
+        database, so of several workers resuming the same job one wins.
+        """
+        with self._lock:
+            claimed = self._db.execute(
+                "UPDATE jobs SET owner = ? WHERE id = ? AND status IN (?, ?) AND owner IS ?",
+                (owner, job_id, *UNFINISHED, previous),
+            ).rowcount
+            if claimed:
+                job = self._load(job_id)
+                job.update(owner=owner, updated=time.time())
+                self._save(job)
+            self._db.commit()
+            return bool(claimed)
+
+
+def make_job_store(kind: str = JOB_STORE):
+    if kind == "sqlite":
+        return SQLiteJobStore()
+    if kind == "memory":
+        return InMemoryJobStore()
+    raise ValueError(f"Unknown JOB_STORE: {kind}")
+
+
+def check_callback_url(url: str) -> None:
+    # Callbacks only go to local services; anything else is refused up front
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or parsed.hostname not in JOB_CALLBACK_HOSTS:
+        raise ValueError(f"Callback URL must be http(s) on one of: {', '.join(sorted(JOB_CALLBACK_HOSTS))}")
+
+
+def _post_json(url: str, payload: dict) -> None:
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"}, method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=JOB_CALLBACK_TIMEOUT):
+        pass
+
+
+class JobManager:
+    """Runs /validate-documents submissions in the background.
+
+    Results are written to the store document by document as they finish,
+    so GET /jobs/{id} shows partial progress. Uploads are kept in JOB_DIR
+    until the job ends; on startup, unfinished jobs whose uploads are still
+    there are resumed and the others are marked interrupted.
+    """
+
+    def __init__(
+        self,
+        scheduler: ValidationScheduler,
+        store=None,
+        workers: int = JOB_WORKERS,
+        job_dir: str = JOB_DIR,
+        admission: Optional[AdmissionController] = None,
+        document_store: Optional[DocumentStore] = None,
+    ):
+        self.scheduler = scheduler
+        self.store = store if store is not None else make_job_store()
+        # Jobs share the interactive requests' budget, but wait instead of being refused
+        self.admission = admission if admission is not None else AdmissionController()
+        self.document_store = document_store
+        self.job_dir = job_dir
+        self._slots = asyncio.Semaphore(workers)
+        self._tasks = set()
+        self.owner = f"{JOB_LAUNCH}:{os.getpid()}"
+
+    def submit(self, form: dict, files: Dict[str, IngestedFile], callback_url: Optional[str] = None) -> dict:
+        if callback_url:
+            check_callback_url(callback_url)
+        job_id = uuid.uuid4().hex
+        directory = os.path.join(self.job_dir, job_id)
+        os.makedirs(directory, exist_ok=True)
+        for name, ingested in files.items():
+            if not ingested.keep:
+                ingested.persist(os.path.join(directory, f"{name}.pdf"))
+
+        now = time.time()
+        job = {
+            "id": job_id,
+            "status": "pending",
+            "created": now,
+            "updated": now,
+            "callback_url": callback_url,
+            "owner": self.owner,
+            "form": form,
+            "files": {name: ingested.to_dict() for name, ingested in files.items()},
+            "results": {},
+            "response": None,
+            "error": None,
+        }
+        self.store.create(job)
+        self._start(job_id, form, files, callback_url)
+        return job
+
+    def _start(self, job_id: str, form: dict, files: Dict[str, IngestedFile], callback_url: Optional[str]) -> None:
+        task = asyncio.ensure_future(self._run(job_id, form, files, callback_url))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job_id: str, form: dict, files: Dict[str, IngestedFile], callback_url: Optional[str]) -> None:
+        async with self._slots:
+            self.store.update(job_id, status="running")
+            try:
+                jobs = validation_jobs(files, form)
+                async with self.admission.admit(estimate_cost(files), "jobs", shed=False):
+                    results, documents = await self.scheduler.run(
+                        jobs,
+                        on_result=lambda name, result: self.store.set_result(
+                            job_id, DOCUMENT_VALIDATIONS[name][0], result
+                        ),
+                    )
+                if self.document_store is not None:
+                    await asyncio.to_thread(self.document_store.save_results, files, jobs, results)
+                self.store.update(job_id, status="done", response=validation_response(results, documents))
+            except Exception as e:
+                self.store.update(job_id, status="failed", error=str(e))
+            # Uploads go once the job is done or failed; a cancelled job (e.g. at
+            # shutdown) stays unfinished with its uploads, for resume()
+            for ingested in files.values():
+                ingested.close()
+            shutil.rmtree(os.path.join(self.job_dir, job_id), ignore_errors=True)
+
+        if callback_url:
+            job = self.store.get(job_id)
+            # Upload locations and the owner are internal, as in GET /jobs/{id}
+            job.pop("files", None)
+            job.pop("owner", None)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, _post_json, callback_url, job)
+            except Exception as e:
+                print(f"Callback for job {job_id} failed: {e}")
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.store.get(job_id)
+
+    def resume(self) -> None:
+        """Restart unfinished jobs left by a previous process.
+
+        With several workers on one job store each of them resumes at
+        startup; a job is only taken over once its owner is gone, and by
+        the one worker whose claim succeeds.
+        """
+        for job in self.store.unfinished():
+            if not orphaned(job.get("owner")) or not self.store.claim(job["id"], job.get("owner"), self.owner):
+                continue
+            files = {name: IngestedFile.from_dict(data) for name, data in job["files"].items()}
+            if all(ingested.path and os.path.exists(ingested.path) for ingested in files.values()):
+                self.store.update(job["id"], status="pending", results={})
+                self._start(job["id"], job["form"], files, job["callback_url"])
+            else:
+                self.store.update(job["id"], status="interrupted", error="Uploads were lost before the job finished")
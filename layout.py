@@ -0,0 +1,200 @@
+import os
+import re
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+
+# Keep word boxes of the documents whose validators look values up by label
+LAYOUT_INDEX = os.getenv("LAYOUT_INDEX", "1") == "1"
+
+# Words further apart than this many line heights are in different columns
+MAX_GAP = 3.0
+# How far below a label (in line heights) its value may start
+MAX_DROP = 2.5
+
+_PUNCTUATION = re.compile(r'[^\w]+')
+
+
+def _key(word: str) -> str:
+    return _PUNCTUATION.sub('', word.lower())
+
+
+def text_words(words: list) -> List[list]:
+    """Compact [x0, y0, x1, y1, text, frame] rows from page.get_text("words"); frame 0 is the text layer."""
+    return [[round(x0, 1), round(y0, 1), round(x1, 1), round(y1, 1), text, 0] for x0, y0, x1, y1, text, *_ in words]
+
+
+def ocr_words(texts: List[str], boxes: List[list], frame: int) -> List[list]:
+    """Word rows for OCR results, whose boxes hold whole phrases.
+
+    Each word gets the share of its phrase's box that its characters take
+    up. Coordinates are those of the raster that was read, so every OCR'd
+    raster is a frame of its own.
+    """
+    words = []
+    for text, (x0, y0, x1, y1) in zip(texts, boxes):
+        per_char = (x1 - x0) / max(1, len(text))
+        for match in re.finditer(r'\S+', text):
+            words.append([
+                round(x0 + match.start() * per_char, 1), round(y0, 1),
+                round(x0 + match.end() * per_char, 1), round(y1, 1), match.group(), frame,
+            ])
+    return words
+
+
+class PageLayout:
+    """The words of one page with their boxes, in flat arrays on a uniform grid.
+
+    Words stay in reading order. A label is found through a dict from
+    normalized word to positions; the words around it are found by looking
+    only at the grid cells of the strip to its right or just below it, so a
+    lookup costs about the same on a one-page certificate as on a long lease.
+    """
+
+    def __init__(self, words: List[list]):
+        self.texts = [word[4] for word in words]
+        self.keys = [_key(text) for text in self.texts]
+        self.boxes = np.array([word[:4] for word in words], dtype=np.float32).reshape(-1, 4)
+        self.frames = np.array([word[5] for word in words], dtype=np.int32)
+        self.labels = np.array([text.endswith(':') for text in self.texts], dtype=bool)
+        heights = self.boxes[:, 3] - self.boxes[:, 1]
+        self.heights = np.maximum(heights, 1.0)
+        self._positions: Dict[str, List[int]] = {}
+        for index, key in enumerate(self.keys):
+            self._positions.setdefault(key, []).append(index)
+
+        # Cells one line high and a few words wide; words are listed in every cell they touch
+        line = float(np.median(self.heights)) if len(words) else 1.0
+        self._cell = np.array([4 * line, line], dtype=np.float32)
+        low = np.maximum(np.floor(self.boxes[:, :2] / self._cell), 0).astype(np.int64)
+        high = np.maximum(np.floor(self.boxes[:, 2:] / self._cell), 0).astype(np.int64)
+        self._columns = int(high[:, 0].max()) + 1 if len(words) else 1
+        cells, members = [], []
+        for index, ((c0, r0), (c1, r1)) in enumerate(zip(low, high)):
+            for row in range(r0, r1 + 1):
+                for column in range(c0, c1 + 1):
+                    cells.append(row * self._columns + column)
+                    members.append(index)
+        order = np.argsort(cells, kind="stable")
+        self._cells = np.array(cells, dtype=np.int64)[order]
+        self._members = np.array(members, dtype=np.int64)[order]
+
+    def _query(self, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+        """Indexes of the words in the grid cells that cover a rectangle."""
+        c0, r0 = np.floor(np.array([x0, y0]) / self._cell).astype(np.int64)
+        c1, r1 = np.floor(np.array([x1, y1]) / self._cell).astype(np.int64)
+        c0, c1 = max(0, c0), min(self._columns - 1, c1)
+        found = []
+        for row in range(max(0, r0), r1 + 1):
+            start = np.searchsorted(self._cells, row * self._columns + c0)
+            end = np.searchsorted(self._cells, row * self._columns + c1, side="right")
+            found.append(self._members[start:end])
+        return np.unique(np.concatenate(found)) if found else np.array([], dtype=np.int64)
+
+    def find(self, label: str) -> Iterator[int]:
+        """Positions of the last word of each occurrence of a (multi-word) label.
+
+        Each word of the label must follow the previous one on its line or
+        start the line below it, so "Seller:" over "Name:" is found in
+        either column of a two-column form.
+        """
+        keys = [key for key in (_key(word) for word in label.split()) if key]
+        if not keys:
+            return
+        for current in self._positions.get(keys[0], []):
+            for key in keys[1:]:
+                current = self._follower(current, key)
+                if current is None:
+                    break
+            else:
+                yield current
+
+    def _follower(self, index: int, key: str) -> Optional[int]:
+        right = self._right(index)
+        if right and self.boxes[right[0], 0] - self.boxes[index, 2] <= MAX_GAP * self.heights[index]:
+            if self.keys[right[0]] == key:
+                return right[0]
+        below = self._below(index)
+        return below if below is not None and self.keys[below] == key else None
+
+    def _right(self, anchor: int) -> List[int]:
+        """The words right of anchor on its line, left to right."""
+        x0, y0, x1, y1 = self.boxes[anchor].tolist()
+        height = float(self.heights[anchor])
+        candidates = self._query(x1 - height / 4, y0, float(self._columns * self._cell[0]), y1)
+        boxes = self.boxes[candidates]
+        overlap = np.minimum(boxes[:, 3], y1) - np.maximum(boxes[:, 1], y0)
+        same_line = (
+            (self.frames[candidates] == self.frames[anchor])
+            & (overlap >= 0.5 * np.minimum(self.heights[candidates], height))
+            & (boxes[:, 0] >= x1 - height / 4)
+            & (candidates != anchor)
+        )
+        return candidates[same_line][np.argsort(boxes[same_line, 0], kind="stable")].tolist()
+
+    def _line_after(self, anchor: int, include: bool = False) -> List[int]:
+        """The words right of anchor on its line, up to a column gap or the next label."""
+        height = float(self.heights[anchor])
+        words = [anchor] if include else []
+        right = float(self.boxes[anchor, 2])
+        for index in self._right(anchor):
+            if self.boxes[index, 0] - right > MAX_GAP * height or self.labels[index]:
+                break
+            words.append(index)
+            right = max(right, float(self.boxes[index, 2]))
+        return words
+
+    def _below(self, anchor: int) -> Optional[int]:
+        """The first word under anchor, roughly aligned with it."""
+        x0, y0, x1, y1 = self.boxes[anchor].tolist()
+        height = float(self.heights[anchor])
+        candidates = self._query(x0 - height, y1, x1 + height, y1 + MAX_DROP * height)
+        boxes = self.boxes[candidates]
+        below = (
+            (self.frames[candidates] == self.frames[anchor])
+            & (boxes[:, 1] >= y0 + height / 2)
+            & (boxes[:, 1] <= y1 + MAX_DROP * height)
+            & (boxes[:, 0] >= x0 - height)
+            & (boxes[:, 0] <= x1 + height)
+        )
+        if not below.any():
+            return None
+        candidates, boxes = candidates[below], boxes[below]
+        return int(candidates[np.lexsort((boxes[:, 0], boxes[:, 1]))[0]])
+
+    def value(self, anchor: int) -> str:
+        """The text right of the label ending at anchor, or else on the line below it."""
+        words = self._line_after(anchor)
+        if not words:
+            first = self._below(anchor)
+            if first is None or self.labels[first]:
+                return ""
+            words = self._line_after(first, include=True)
+        return " ".join(self.texts[index] for index in words)
+
+
+class DocumentLayout:
+    def __init__(self, pages: List[PageLayout]):
+        self.pages = pages
+
+    def values(self, label: str) -> List[str]:
+        """The value next to every occurrence of label, in page order."""
+        found = []
+        for page in self.pages:
+            for anchor in page.find(label):
+                value = page.value(anchor)
+                if value:
+                    found.append(value)
+        return found
+
+    def value(self, label: str) -> Optional[str]:
+        values = self.values(label)
+        return values[0] if values else None
+
+
+def document_layout(document) -> Optional[DocumentLayout]:
+    """The layout index of an ExtractedDocument read with layout=True, or None."""
+    if not any(page.words is not None for page in document.pages):
+        return None
+    return DocumentLayout([PageLayout(page.words) for page in document.pages if page.words])
@@ -1,14 +1,34 @@
-from fastapi import FastAPI, File, Form, UploadFile
-from fastapi.responses import JSONResponse
-from typing import List, Optional
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 import fitz  # remove if you want pure built-in only
 import io
+import asyncio
+import json
+import zipfile
 from fastapi.middleware.cors import CORSMiddleware
 
 from utils import *
+from scheduler import ValidationScheduler
+from ocr import OCR_ENGINES, OCR_WARMUP, engines_in_use, ocr_engine
+from cache import extraction_cache
+from preprocess import preprocessor
+import page_hash
+from ingest import RequestBudget, RequestSizeLimitMiddleware, ingest_upload, memory_usage
+from jobs import JobManager, check_callback_url
+from admission import AdmissionController, client_key, estimate_cost
+from store import document_store
+from bulk import BULK_MAX_BYTES, FileResolver, parse_manifest, run_bulk
+from metrics import SERVER_TIMING, collect, registry, server_timing
+import time
 
 app = FastAPI()
+scheduler = ValidationScheduler()
+admission = AdmissionController()
+job_manager = JobManager(scheduler, admission=admission, document_store=document_store)
+
+app.add_middleware(RequestSizeLimitMiddleware, limits={"/bulk/validate": BULK_MAX_BYTES})
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,14 +39,73 @@ app.add_middleware(
 )
 
 
-@app.post("/validate-documents")
-async def process_form(
+registry.callback("extraction_cache_hits_total", "Extraction cache hits", lambda: extraction_cache.hits, "counter")
+registry.callback("extraction_cache_misses_total", "Extraction cache misses", lambda: extraction_cache.misses, "counter")
+registry.callback("extraction_cache_entries", "Documents in the in-memory cache", lambda: extraction_cache.stats()["entries"])
+registry.callback("extraction_cache_bytes", "Approximate size of the in-memory cache", lambda: extraction_cache.stats()["bytes"])
+if page_hash.OCR_PAGE_HASH:
+    registry.callback("ocr_page_hash_hit_rate", "Share of OCR'd pages whose text was reused", lambda: page_hash.stats()["hit_rate"])
+registry.callback("ocr_model_ready", "1 once the OCR models are loaded", lambda: int(ocr_engine.ready))
+registry.callback("ocr_model_load_seconds", "Time it took to load the OCR models", lambda: ocr_engine.load_seconds)
+registry.callback("admission_queue_depth", "Requests waiting for admission", lambda: admission.queued)
+registry.callback("admission_queued_cost", "Estimated cost of the waiting requests", lambda: admission.queued_cost)
+registry.callback("admission_in_flight_cost", "Estimated cost of the admitted requests", lambda: admission.in_flight)
+registry.callback("process_peak_rss_kb", "Peak resident set size", lambda: memory_usage().get("peak_rss_kb"))
+
+
+@app.on_event("startup")
+def warm_up_ocr():
+    # Load the OCR models in the background; text-layer PDFs are served meanwhile.
+    # Engines no configured policy uses are never loaded.
+    if OCR_WARMUP:
+        for engine in engines_in_use():
+            engine.warm_up()
+
+
+@app.on_event("startup")
+async def resume_jobs():
+    job_manager.resume()
+
+
+@app.on_event("shutdown")
+def shutdown_scheduler():
+    scheduler.shutdown()
+
+
+@app.get("/ready")
+def readiness():
+    return {
+        "status": "ok",
+        "ocr": ocr_engine.status(),
+        "ocr_engines": {engine.name: engine.status() for engine in OCR_ENGINES.values() if engine in engines_in_use()},
+        "ocr_preprocess": preprocessor.steps,
+        "cache": extraction_cache.stats(),
+        "page_hashes": page_hash.stats() if page_hash.OCR_PAGE_HASH else None,
+        "admission": admission.stats(),
+        "document_store": document_store.stats() if document_store is not None else None,
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+async def validation_form(
     businessAddress: str = Form(...),
     firstName: str = Form(...),
     lastName: str = Form(...),
     ownerName: str = Form(...),
     companyNumber: str = Form(...),
     companyName: str = Form(...),
+) -> dict:
+    return dict(
+        businessAddress=businessAddress, firstName=firstName, lastName=lastName,
+        ownerName=ownerName, companyNumber=companyNumber, companyName=companyName,
+    )
+
+
+async def validation_uploads(
     IDCardAttachment: UploadFile = File(...),
     KBORegisterExtract: UploadFile = File(...),
     OfficialGazettePublication: UploadFile = File(...),
@@ -34,64 +113,263 @@ async def process_form(
     LiabilityInsuranceCopy: UploadFile = File(...),
     CommercialLeaseAgreement: UploadFile = File(...),
     ElectricCertificate: UploadFile = File(...),
-):
-    # Step 1: Check if each file contains text or images
-    files = {}
-    for name, file in [
-        ("IDCardAttachment", IDCardAttachment),
-        ("KBORegisterExtract", KBORegisterExtract),
-        ("OfficialGazettePublication", OfficialGazettePublication),
-        ("MoralityCertificate", MoralityCertificate),
-        ("LiabilityInsuranceCopy", LiabilityInsuranceCopy),
-        ("CommercialLeaseAgreement", CommercialLeaseAgreement),
-        ("ElectricCertificate", ElectricCertificate),
-    ]:
-        contents = await file.read()
-        files[name] = contents
-
-    # Step 1: Check if each file contains text or images
-    file_checks = {
-        name: detect_pdf_type(data)
-        for name, data in files.items()
+) -> dict:
+    return {
+        "IDCardAttachment": IDCardAttachment,
+        "KBORegisterExtract": KBORegisterExtract,
+        "OfficialGazettePublication": OfficialGazettePublication,
+        "MoralityCertificate": MoralityCertificate,
+        "LiabilityInsuranceCopy": LiabilityInsuranceCopy,
+        "CommercialLeaseAgreement": CommercialLeaseAgreement,
+        "ElectricCertificate": ElectricCertificate,
     }
 
-    # Step 2: Validate ID card name and expiry
-
-    id_validation = validate_id_card(files["IDCardAttachment"], firstName,lastName)
-    
-    kbo_register = validate_kbo_register_extract(files["KBORegisterExtract"],
-                                                 companyName,companyNumber,
-                                                 firstName,lastName)
-    
-    official_gazette = validate_official_gazette_publication(files["OfficialGazettePublication"],
-                                                 companyName,companyNumber)
-    
-    morality_certificate = validate_morality_certificate(files["MoralityCertificate"],
-                                                 firstName,lastName)
-    
-    commercial_lease = validate_commercial_lease(
-                    file_bytes=files["CommercialLeaseAgreement"],
-                    building_owner_name=ownerName,
-                    restaurant_address=businessAddress
+
+async def ingest_uploads(uploads: dict) -> dict:
+    # Stream each upload in chunks, enforcing size and page limits early
+    budget = RequestBudget()
+    files = {}
+    try:
+        for name, upload in uploads.items():
+            files[name] = await ingest_upload(name, upload, budget)
+    except BaseException:
+        for ingested in files.values():
+            ingested.close()
+        raise
+    return files
+
+
+async def run_validation(request: Request, uploads: dict, form: dict) -> JSONResponse:
+    started = time.perf_counter()
+    with collect() as timings:
+        # Step 1: Read the uploads
+        files = await ingest_uploads(uploads)
+        try:
+            if document_store is not None:
+                await asyncio.to_thread(document_store.save_all, files)
+
+            # Step 2: Wait for a share of the OCR budget, or get a 429, then extract
+            # and validate the documents concurrently, off the event loop
+            jobs = validation_jobs(files, form)
+            async with admission.admit(estimate_cost(files), client_key(request)):
+                results, documents = await scheduler.run(jobs)
+            if document_store is not None:
+                await asyncio.to_thread(document_store.save_results, files, jobs, results)
+
+            # Step 3: Report whether each file contained text or images, and the checks
+            response = JSONResponse(validation_response(results, documents))
+        finally:
+            for ingested in files.values():
+                ingested.close()
+
+    usage = memory_usage()
+    if "peak_rss_kb" in usage:
+        response.headers["X-Peak-RSS-KB"] = str(usage["peak_rss_kb"])
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(timings, time.perf_counter() - started)
+    return response
+
+
+@app.post("/validate-documents")
+async def process_form(
+    request: Request,
+    form: dict = Depends(validation_form),
+    uploads: dict = Depends(validation_uploads),
+):
+    return await run_validation(request, uploads, form)
+
+
+# One endpoint per document, so a corrected upload can be checked on its own.
+# They share the scheduler and extraction cache with /validate-documents.
+
+@app.post("/validate/id-card")
+async def validate_id_card_upload(
+    request: Request,
+    IDCardAttachment: UploadFile = File(...),
+    firstName: str = Form(...),
+    lastName: str = Form(...),
+):
+    return await run_validation(
+        request,
+        {"IDCardAttachment": IDCardAttachment}, dict(firstName=firstName, lastName=lastName)
+    )
+
+
+@app.post("/validate/kbo-register")
+async def validate_kbo_register_upload(
+    request: Request,
+    KBORegisterExtract: UploadFile = File(...),
+    companyName: str = Form(...),
+    companyNumber: str = Form(...),
+    firstName: str = Form(...),
+    lastName: str = Form(...),
+):
+    return await run_validation(
+        request,
+        {"KBORegisterExtract": KBORegisterExtract},
+        dict(companyName=companyName, companyNumber=companyNumber, firstName=firstName, lastName=lastName),
+    )
+
+
+@app.post("/validate/official-gazette")
+async def validate_official_gazette_upload(
+    request: Request,
+    OfficialGazettePublication: UploadFile = File(...),
+    companyName: str = Form(...),
+    companyNumber: str = Form(...),
+):
+    return await run_validation(
+        request,
+        {"OfficialGazettePublication": OfficialGazettePublication},
+        dict(companyName=companyName, companyNumber=companyNumber),
     )
 
-    liability_insurance = validate_liability_insurance(
-        file_bytes=files["LiabilityInsuranceCopy"],
-        company_name=companyName
+
+@app.post("/validate/morality-certificate")
+async def validate_morality_certificate_upload(
+    request: Request,
+    MoralityCertificate: UploadFile = File(...),
+    firstName: str = Form(...),
+    lastName: str = Form(...),
+):
+    return await run_validation(
+        request,
+        {"MoralityCertificate": MoralityCertificate}, dict(firstName=firstName, lastName=lastName)
     )
 
-    electric_certificate = validate_electric_certificate(
-        file_bytes=files["ElectricCertificate"],
-        expected_address=businessAddress
+
+@app.post("/validate/commercial-lease")
+async def validate_commercial_lease_upload(
+    request: Request,
+    CommercialLeaseAgreement: UploadFile = File(...),
+    ownerName: str = Form(...),
+    businessAddress: str = Form(...),
+):
+    return await run_validation(
+        request,
+        {"CommercialLeaseAgreement": CommercialLeaseAgreement},
+        dict(ownerName=ownerName, businessAddress=businessAddress),
     )
 
-    return JSONResponse({
-        "pdf_checks": file_checks,
-        "id_card_valid": id_validation,
-        "kbo_register_valid": kbo_register,
-        "official_gazette_valid": official_gazette,
-        "morality_certificate_valid": morality_certificate,
-        "commercial_lease_valid": commercial_lease,
-        "liability_insurance_valid": liability_insurance,
-        "electric_certificate_valid": electric_certificate,
-    })
+
+@app.post("/validate/liability-insurance")
+async def validate_liability_insurance_upload(
+    request: Request,
+    LiabilityInsuranceCopy: UploadFile = File(...),
+    companyName: str = Form(...),
+):
+    return await run_validation(
+        request,
+        {"LiabilityInsuranceCopy": LiabilityInsuranceCopy}, dict(companyName=companyName)
+    )
+
+
+@app.post("/validate/electric-certificate")
+async def validate_electric_certificate_upload(
+    request: Request,
+    ElectricCertificate: UploadFile = File(...),
+    businessAddress: str = Form(...),
+):
+    return await run_validation(
+        request,
+        {"ElectricCertificate": ElectricCertificate}, dict(businessAddress=businessAddress)
+    )
+
+
+@app.post("/jobs/validate-documents", status_code=202)
+async def submit_validation_job(
+    form: dict = Depends(validation_form),
+    uploads: dict = Depends(validation_uploads),
+    callbackUrl: Optional[str] = Form(None),
+):
+    if callbackUrl:
+        try:
+            check_callback_url(callbackUrl)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    files = await ingest_uploads(uploads)
+    if document_store is not None:
+        await asyncio.to_thread(document_store.save_all, files)
+    job = job_manager.submit(form, files, callback_url=callbackUrl)
+    return {"job_id": job["id"], "status": job["status"], "status_url": f"/jobs/{job['id']}"}
+
+
+class RevalidationRequest(BaseModel):
+    businessAddress: str
+    firstName: str
+    lastName: str
+    ownerName: str
+    companyNumber: str
+    companyName: str
+    # Upload field -> sha256 of a document in the store
+    documents: Dict[str, str]
+    callbackUrl: Optional[str] = None
+
+
+@app.post("/jobs/revalidate", status_code=202)
+async def submit_revalidation_job(body: RevalidationRequest):
+    # Validates stored documents against new form values, without uploading them again
+    if document_store is None:
+        raise HTTPException(status_code=404, detail="The document store is not enabled")
+    unknown = sorted(set(body.documents) - set(DOCUMENT_VALIDATIONS))
+    if unknown or not body.documents:
+        raise HTTPException(status_code=422, detail=f"Unknown or missing document fields: {', '.join(unknown)}")
+    if body.callbackUrl:
+        try:
+            check_callback_url(body.callbackUrl)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    files = {}
+    for name, sha256 in body.documents.items():
+        ingested = await asyncio.to_thread(document_store.open, sha256.lower())
+        if ingested is None:
+            raise HTTPException(status_code=404, detail=f"{name}: document {sha256} is not stored")
+        files[name] = ingested
+    form = body.dict(exclude={"documents", "callbackUrl"})
+    job = job_manager.submit(form, files, callback_url=body.callbackUrl)
+    return {"job_id": job["id"], "status": job["status"], "status_url": f"/jobs/{job['id']}"}
+
+
+@app.get("/documents/{sha256}")
+def get_stored_document(sha256: str):
+    document = document_store.lookup(sha256.lower()) if document_store is not None else None
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document
+
+
+@app.post("/bulk/validate")
+async def bulk_validate(
+    request: Request,
+    manifest: UploadFile = File(...),
+    archive: Optional[UploadFile] = File(None),
+):
+    # One NDJSON line per dossier as it finishes, then a summary line.
+    # Files come from the zip archive or the document store, never from server paths.
+    try:
+        entries = parse_manifest(await manifest.read())
+        bundle = zipfile.ZipFile(archive.file) if archive is not None else None
+    except (ValueError, zipfile.BadZipFile) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    resolver = FileResolver(archive=bundle, store=document_store)
+
+    async def lines():
+        try:
+            async for line in run_bulk(entries, resolver, scheduler, admission, client_key(request)):
+                yield json.dumps(line) + "\n"
+        finally:
+            if bundle is not None:
+                bundle.close()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/jobs/{job_id}")
+def get_validation_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Upload locations and the worker running the job are internal
+    job.pop("files", None)
+    job.pop("owner", None)
+    return job
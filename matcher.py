@@ -0,0 +1,347 @@
+import os
+import re
+from collections import Counter
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+
+# Share of a field's characters that must survive OCR for it to count as found
+FUZZY_MATCH_THRESHOLD = float(os.getenv("FUZZY_MATCH_THRESHOLD", "0.85"))
+# Best-voted start positions checked with edit distance per fuzzy lookup
+FUZZY_CANDIDATES = int(os.getenv("FUZZY_CANDIDATES", "32"))
+
+
+# Compiled once; the validators only pick the views and scans they need
+
+_NON_DIGIT = re.compile(r'\D')
+_NON_ALNUM = re.compile(r'[^a-z0-9]')
+_ID_NOISE = re.compile(r'[^a-z0-9./-]')  # keeps date separators
+_MORALITY_NOISE = re.compile(r'[^\w\s/]')  # keeps slashes for dates
+_DATE_SEPARATOR = re.compile(r'[/.-]')
+_WHITESPACE = re.compile(r'\s+')
+_TOKEN = re.compile(r'[a-z0-9]+')
+# Number-like tokens (holding a digit) and the whitespace-separated runs of them, e.g. "0123 456 789"
+_NUMBER_RUN = re.compile(r'(?<!\S)(?=\S*\d)\S+(?:\s+(?=\S*\d)\S+)*')
+# Digit and letter tokens of a name or address; dots are dropped first so "B.V." reads as "bv"
+_FIELD_TOKEN = re.compile(r'\d+|[a-z]+')
+# Legal-form suffixes: the same name with another form is another party
+LEGAL_FORMS = frozenset({
+    'bv', 'bvba', 'nv', 'cv', 'cvba', 'vof', 'commv', 'vzw',
+    'srl', 'sprl', 'sa', 'sc', 'scrl', 'snc', 'scs', 'asbl',
+})
+# Letters OCR commonly reads in place of digits
+_DIGIT_LOOKALIKES = str.maketrans({'o': '0', 'i': '1', 'l': '1', 'z': '2', 's': '5', 'b': '8'})
+
+# Every date format an ID card shows, in one alternation over the lowercased
+# text: the expiry next to its label (OCR may garble the gap), day-first dates
+# and ISO dates. The lookahead skips positions no alternative can start at.
+_ID_DATES = re.compile(
+    r"(?=[gve\d])(?:"
+    r"(?:geldig|valid|valable|verloopt|expires?)[^\d]{1,20}(?P<labelled>\d{2}[./-]\d{2}[./-]\d{4})"
+    r"|\b(?P<dayfirst>\d{2}[./-]\d{2}[./-]\d{4})\b"
+    r"|\b(?P<iso>\d{4}[./-]\d{2}[./-]\d{2})\b"
+    r"|\b(?P<spaced>\d{2}\s\d{2}\s\d{4})\b"
+    r")"
+)
+_ID_DATE_FORMATS = {"labelled": "%d.%m.%Y", "dayfirst": "%d.%m.%Y", "iso": "%Y.%m.%d", "spaced": "%d %m %Y"}
+
+DATUM_DATE = re.compile(r'(?:datum\s*:?\s*)(\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4})', re.IGNORECASE)
+_SHORT_DATE = re.compile(r'\b(\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4})\b')
+
+SELLER = re.compile(r'Seller:\s*Name:\s*(.*?)\s*Address:\s*(.*?)\s*VAT', re.IGNORECASE | re.DOTALL)
+LOCATED_AT = re.compile(r'located at\s+(.*?)\s*(?=\bthe Buyer\b|$)', re.IGNORECASE | re.DOTALL)
+LOCATED_AT_COMPLETE = re.compile(r'located at\s+.*?\bthe Buyer\b', re.IGNORECASE | re.DOTALL)
+
+PERIOD = re.compile(r"van\s+(\d{1,2}\s+\w+\s+\d{4})\s+tot\s+(\d{1,2}\s+\w+\s+\d{4})", re.IGNORECASE)
+
+CONFORMITY = re.compile(r'DE INSTALLATIE IS CONFORM', re.IGNORECASE)
+ADDRESS_LINE = re.compile(r'Adres:\s*(.*)', re.IGNORECASE)
+_ADDRESS_NOISE = re.compile(r'[^a-zA-Z0-9\s,]')
+_SPACES = re.compile(r'\s{2,}')
+
+MONTHS = {
+    'januari': '01', 'january': '01',
+    'februari': '02', 'february': '02',
+    'maart': '03', 'march': '03',
+    'april': '04',
+    'mei': '05', 'may': '05',
+    'juni': '06', 'june': '06',
+    'juli': '07', 'july': '07',
+    'augustus': '08', 'august': '08',
+    'september': '09',
+    'oktober': '10', 'october': '10',
+    'november': '11',
+    'december': '12'
+}
+
+
+class TextViews:
+    """The normalized forms of one document text that the validators compare against.
+
+    Each view is built on first use, with one regex pass over the text.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self._lower = None
+        self._id_clean = None
+        self._morality_clean = None
+        self._digits = None
+        self._alnum = None
+        self._tokens = None
+        self._positions = None
+        self._trigrams = None
+        self._number_runs = None
+
+    @property
+    def lower(self) -> str:
+        if self._lower is None:
+            self._lower = self.text.lower().replace('\n', ' ')
+        return self._lower
+
+    @property
+    def id_clean(self) -> str:
+        if self._id_clean is None:
+            self._id_clean = _ID_NOISE.sub(' ', self.lower.replace('  ', ' '))
+        return self._id_clean
+
+    @property
+    def morality_clean(self) -> str:
+        if self._morality_clean is None:
+            self._morality_clean = _MORALITY_NOISE.sub('', self.lower)
+        return self._morality_clean
+
+    @property
+    def digits(self) -> str:
+        if self._digits is None:
+            self._digits = _NON_DIGIT.sub('', self.lower)
+        return self._digits
+
+    @property
+    def alnum(self) -> str:
+        if self._alnum is None:
+            self._alnum = _NON_ALNUM.sub('', self.lower)
+        return self._alnum
+
+    @property
+    def tokens(self) -> List[str]:
+        if self._tokens is None:
+            self._tokens = _TOKEN.findall(self.lower)
+        return self._tokens
+
+    @property
+    def positions(self) -> Dict[str, List[int]]:
+        """Where each distinct token occurs."""
+        if self._positions is None:
+            positions: Dict[str, List[int]] = {}
+            for position, token in enumerate(self.tokens):
+                positions.setdefault(token, []).append(position)
+            self._positions = positions
+        return self._positions
+
+    @property
+    def trigrams(self) -> Dict[str, List[str]]:
+        """Distinct tokens by the trigrams they contain (short tokens by themselves)."""
+        if self._trigrams is None:
+            index: Dict[str, List[str]] = {}
+            for token in self.positions:
+                for gram in set(_trigrams(token)):
+                    index.setdefault(gram, []).append(token)
+            self._trigrams = index
+        return self._trigrams
+
+    @property
+    def number_runs(self) -> List[str]:
+        # Digits of each run of number-like tokens, with letters OCR confuses for digits mapped back
+        if self._number_runs is None:
+            self._number_runs = [
+                _NON_DIGIT.sub('', run.translate(_DIGIT_LOOKALIKES)) for run in _NUMBER_RUN.findall(self.lower)
+            ]
+        return self._number_runs
+
+    def fuzzy_find(self, phrase: str, threshold: float = FUZZY_MATCH_THRESHOLD) -> Tuple[float, str]:
+        """Best approximate occurrence of phrase, compared on letters and digits.
+
+        Returns a score (1 - edit distance / phrase length; 0.0 when no
+        occurrence is within the threshold) and the matched tokens. Candidate
+        positions come from the trigram index, so the cost grows with the
+        number of tokens sharing a trigram with the phrase rather than with
+        the document length times the phrase length.
+        """
+        words = _TOKEN.findall(phrase.lower())
+        target = "".join(words)
+        if not target:
+            return 0.0, ""
+        if target in self.alnum:
+            return 1.0, " ".join(words)
+        max_distance = int(len(target) * (1 - threshold))
+        if not max_distance:
+            return 0.0, ""
+
+        # Every occurrence of a token sharing trigrams with the i-th word votes
+        # for a phrase starting i tokens earlier
+        votes = Counter()
+        for offset, word in enumerate(words):
+            shared = Counter()
+            for gram in set(_trigrams(word)):
+                shared.update(self.trigrams.get(gram, ()))
+            for token, weight in shared.items():
+                for position in self.positions[token]:
+                    votes[position - offset] += weight
+
+        best, best_text = 0.0, ""
+        tokens = self.tokens
+        for start, _ in votes.most_common(FUZZY_CANDIDATES):
+            # OCR splits and merges words, so try one token fewer and more
+            for length in (len(words) - 1, len(words), len(words) + 1):
+                if length < 1 or start < 0 or start + length > len(tokens):
+                    continue
+                candidate = "".join(tokens[start:start + length])
+                distance = bounded_levenshtein(target, candidate, max_distance)
+                if distance <= max_distance:
+                    score = 1 - distance / len(target)
+                    if score > best:
+                        best, best_text = score, " ".join(tokens[start:start + length])
+        return best, best_text
+
+    def number_score(self, number: str) -> float:
+        """1.0 when number's digits appear in the text, else 0.0.
+
+        A number that differs in one digit is a different number, so the
+        digits must match exactly; only letters OCR reads in place of digits
+        (O for 0, l for 1, ...) inside one run of number-like tokens are
+        mapped back first.
+        """
+        digits = _NON_DIGIT.sub('', number)
+        if not digits:
+            return 0.0
+        if digits in self.digits or any(digits in run for run in self.number_runs):
+            return 1.0
+        return 0.0
+
+
+def _trigrams(token: str) -> List[str]:
+    if len(token) < 3:
+        return [token]
+    return [token[index:index + 3] for index in range(len(token) - 2)]
+
+
+def bounded_levenshtein(a: str, b: str, max_distance: int) -> int:
+    """Edit distance of a and b, or max_distance + 1 once it is known to exceed it."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        # Only cells within max_distance of the diagonal can stay under the bound
+        low, high = max(1, i - max_distance), min(len(b), i + max_distance)
+        if low > 1:
+            current[low - 1] = max_distance + 1
+        for j in range(low, high + 1):
+            current[j] = min(
+                previous[j] + 1 if j <= i - 1 + max_distance else max_distance + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != b[j - 1]),
+            )
+        if high < len(b):
+            current[high + 1:] = [max_distance + 1] * (len(b) - high)
+        if min(current[low - 1:high + 1]) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[len(b)], max_distance + 1)
+
+
+def similarity(a: str, b: str, threshold: float = FUZZY_MATCH_THRESHOLD) -> float:
+    """1 - edit distance / length of the longer string; 0.0 when below the threshold."""
+    if a == b:
+        return 1.0
+    longest = max(len(a), len(b))
+    max_distance = int(longest * (1 - threshold))
+    distance = bounded_levenshtein(a, b, max_distance)
+    return 1 - distance / longest if distance <= max_distance else 0.0
+
+
+def field_similarity(a: str, b: str, threshold: float = FUZZY_MATCH_THRESHOLD) -> float:
+    """similarity() of the letters of two names or addresses, 0.0 unless their numbers match.
+
+    House numbers, boxes and postcodes must be equal, and so must the legal
+    forms when both values name one; only the remaining words may differ by
+    a few OCR errors.
+    """
+    tokens_a = _FIELD_TOKEN.findall(a.lower().replace('.', ''))
+    tokens_b = _FIELD_TOKEN.findall(b.lower().replace('.', ''))
+    if [t for t in tokens_a if t.isdigit()] != [t for t in tokens_b if t.isdigit()]:
+        return 0.0
+    forms_a = {t for t in tokens_a if t in LEGAL_FORMS}
+    forms_b = {t for t in tokens_b if t in LEGAL_FORMS}
+    if forms_a and forms_b and forms_a != forms_b:
+        return 0.0
+    letters_a = ''.join(t for t in tokens_a if t.isalpha() and t not in LEGAL_FORMS)
+    letters_b = ''.join(t for t in tokens_b if t.isalpha() and t not in LEGAL_FORMS)
+    return similarity(letters_a, letters_b, threshold)
+
+
+@lru_cache(maxsize=16)
+def views(text: str) -> TextViews:
+    """Shared views of a text, so several checks on one document normalize it once."""
+    return TextViews(text)
+
+
+def digits_of(value: str) -> str:
+    return _NON_DIGIT.sub('', value)
+
+
+def normalize_address(address: str) -> str:
+    cleaned = _ADDRESS_NOISE.sub('', address.lower())
+    cleaned = _WHITESPACE.sub(' ', cleaned).replace(',', ' ').strip()
+    return _SPACES.sub(' ', cleaned)
+
+
+def id_card_dates(text_views: TextViews) -> List[datetime]:
+    """Every parseable date on an ID card, from a single scan."""
+    dates = []
+    for match in _ID_DATES.finditer(text_views.id_clean):
+        kind = match.lastgroup
+        try:
+            dates.append(datetime.strptime(_DATE_SEPARATOR.sub('.', match.group(kind)), _ID_DATE_FORMATS[kind]))
+        except ValueError:
+            continue
+    return dates
+
+
+def morality_date_string(text_views: TextViews) -> Optional[str]:
+    """The date right after the first "Datum", else the first date following it.
+
+    Only the first label counts, so once it and a date after it are read,
+    later pages cannot change the result.
+    """
+    lower = text_views.lower
+    start = lower.find('datum')
+    if start < 0:
+        match = _SHORT_DATE.search(lower)
+    else:
+        match = DATUM_DATE.match(lower, start) or _SHORT_DATE.search(lower, start + len('datum'))
+    return match.group(1) if match else None
+
+
+def parse_month_date(date_str: str) -> Optional[str]:
+    """'31 december 2027' (or 31/12/2027) as '2027-12-31'."""
+    parts = _WHITESPACE.split(_DATE_SEPARATOR.sub(' ', date_str).strip())
+    if len(parts) == 3:
+        day, month, year = parts
+        month = MONTHS.get(month.lower(), month)
+        return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+    return None
+
+
+def period_end_dates(text: str) -> List[date]:
+    end_dates = []
+    for _, end_date_str in PERIOD.findall(text):
+        try:
+            parsed = parse_month_date(end_date_str)
+            if parsed:
+                end_dates.append(datetime.strptime(parsed, "%Y-%m-%d").date())
+        except Exception:
+            continue
+    return end_dates
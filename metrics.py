@@ -0,0 +1,169 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+
+# Add a Server-Timing header with the stage breakdown to validation responses
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                yield f"{self.name}{_labels(key)} {value:g}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> (count per bucket, sum, count)
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = 'le="%g"' % bound
+                    yield f"{self.name}_bucket{_labels(key, le)} {bucket_count}"
+                le = 'le="+Inf"'
+                yield f"{self.name}_bucket{_labels(key, le)} {count}"
+                yield f"{self.name}_sum{_labels(key)} {total:.6f}"
+                yield f"{self.name}_count{_labels(key)} {count}"
+
+
+class Registry:
+    """Metrics of this process in the Prometheus text format.
+
+    Callback metrics are read at scrape time, so components such as the
+    extraction cache keep their own counters.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._callbacks = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = BUCKETS) -> Histogram:
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def callback(self, name: str, help: str, read: Callable[[], Optional[float]], kind: str = "gauge") -> None:
+        self._callbacks.append((name, help, read, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, help, read, kind in self._callbacks:
+            value = read()
+            if value is None:
+                continue
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {float(value):g}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "validation_stage_seconds", "Time spent per pipeline stage (parse, render, ocr_detect, ocr_recognize, match, ...)"
+)
+document_seconds = registry.histogram(
+    "validation_document_seconds", "Time from the start of a request until a document's result was ready"
+)
+pages_parsed = registry.counter("pdf_pages_parsed_total", "Pages read from PDF text layers, by page kind")
+ocr_pages = registry.counter("ocr_pages_total", "Pages sent to OCR, including mixed pages")
+validation_errors = registry.counter("validation_errors_total", "Validator results that carried an error, by document")
+
+
+# Per-request stage totals for the Server-Timing header; see collect()
+_request_timings: contextvars.ContextVar = contextvars.ContextVar("request_timings", default=None)
+_timings_lock = threading.Lock()
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block as one pipeline stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            with _timings_lock:
+                timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def collect():
+    """Sum the stage timings of the current request into the yielded dict.
+
+    Work handed to thread pools is only included when it runs in a copy of
+    the request's context (see ValidationScheduler). Stages that run in
+    parallel overlap, so the sums can exceed the wall time.
+    """
+    timings: Dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in sorted(timings.items())]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
@@ -0,0 +1,480 @@
+import contextlib
+import os
+import threading
+import time
+from importlib import metadata
+from multiprocessing.connection import Client
+from typing import Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+OCR_LANGUAGES = [lang.strip() for lang in os.getenv("OCR_LANGUAGES", "en,nl").split(",") if lang.strip()]
+# easyocr reads the small rasters well; Tesseract wants more pixels per glyph
+RENDER_DPI = int(os.getenv("OCR_RENDER_DPI", "72"))
+TESSERACT_DPI = int(os.getenv("TESSERACT_DPI", "200"))
+TESSERACT_LANGUAGES = os.getenv("TESSERACT_LANGUAGES", "eng+nld")
+TESSERACT_CONFIG = os.getenv("TESSERACT_CONFIG", "--oem 1 --psm 3")
+# easyocr, tesseract, or fast-first (Tesseract, then easyocr when fields are missing)
+OCR_POLICY = os.getenv("OCR_POLICY", "easyocr")
+# Per upload field overrides, e.g. "ElectricCertificate=fast-first,IDCardAttachment=easyocr"
+OCR_POLICIES = dict(
+    item.split("=", 1) for item in os.getenv("OCR_POLICIES", "").replace(" ", "").split(",") if "=" in item
+)
+# Directory with pre-downloaded easyocr models; when set, nothing is fetched at runtime
+OCR_MODEL_DIR = os.getenv("OCR_MODEL_DIR")
+OCR_WARMUP = os.getenv("OCR_WARMUP", "1") == "1"
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "4"))
+OCR_RECOGNIZE_CHUNK = int(os.getenv("OCR_RECOGNIZE_CHUNK", "8"))
+# Detected boxes taller than this share of the raster are photos or graphics, not text lines
+OCR_MAX_BOX_HEIGHT = float(os.getenv("OCR_MAX_BOX_HEIGHT", "0.25"))
+# Intra-op threads per OCR call. By default the cores are split between the
+# concurrent OCR calls (OCR_WORKERS threads in each of WEB_CONCURRENCY server
+# processes) rather than every call spinning up one thread per core
+OCR_THREADS = int(os.getenv("OCR_THREADS", "0")) or max(
+    1, (os.cpu_count() or 1) // (int(os.getenv("OCR_WORKERS", "1")) * int(os.getenv("WEB_CONCURRENCY", "1")))
+)
+# Dynamic int8 quantization of the easyocr models (the recognizer's LSTM/linear layers)
+OCR_QUANTIZE = os.getenv("OCR_QUANTIZE", "1") == "1"
+# torch, or onnx to run the exported models under ONNX Runtime (needs onnxruntime)
+OCR_RUNTIME = os.getenv("OCR_RUNTIME", "torch")
+OCR_ONNX_DIR = os.getenv("OCR_ONNX_DIR") or os.path.join(OCR_MODEL_DIR or os.path.expanduser("~/.EasyOCR"), "onnx")
+# Unix socket of a shared OCR server (ocr_server.py); when set, easyocr is not loaded in this process
+OCR_SERVER_SOCKET = os.getenv("OCR_SERVER_SOCKET")
+OCR_SERVER_KEY = os.getenv("OCR_SERVER_KEY", "").encode() or None
+OCR_SERVER_TIMEOUT = float(os.getenv("OCR_SERVER_TIMEOUT", "120"))
+
+
+def _package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def candidate_regions(horizontal: list, free: list, height: int) -> list:
+    """Filter detector output down to plausible text lines, top to bottom.
+
+    horizontal boxes are [x_min, x_max, y_min, y_max], free boxes are four
+    corner points, as returned by easyocr's detector.
+    """
+    limit = height * OCR_MAX_BOX_HEIGHT
+    regions = [("horizontal", box, box[2]) for box in horizontal if box[3] - box[2] <= limit]
+    for box in free:
+        ys = [point[1] for point in box]
+        if max(ys) - min(ys) <= limit:
+            regions.append(("free", box, min(ys)))
+    regions.sort(key=lambda region: region[2])
+    return [(kind, box) for kind, box, _ in regions]
+
+
+def _rgb(image: np.ndarray) -> np.ndarray:
+    return image if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+
+
+class OCREngine:
+    """Owns the process-wide easyocr reader: the accurate, torch-based backend.
+
+    Importing easyocr pulls in torch and loading both language models takes
+    seconds, so nothing happens at import time. The reader is created on the
+    first image-based page, or ahead of time by warm_up() in the background,
+    while text-layer PDFs are served straight away.
+    """
+
+    name = "easyocr"
+    detect_stage = "ocr_detect"
+    recognize_stage = "ocr_recognize"
+
+    def __init__(
+        self,
+        languages: List[str] = OCR_LANGUAGES,
+        model_dir: Optional[str] = OCR_MODEL_DIR,
+        threads: int = OCR_THREADS,
+        quantize: bool = OCR_QUANTIZE,
+        runtime: str = OCR_RUNTIME,
+    ):
+        self.languages = languages
+        self.model_dir = model_dir
+        self.threads = threads
+        self.quantize = quantize
+        self.runtime = runtime
+        self.render_dpi = RENDER_DPI
+        # Read from package metadata so computing cache keys never imports torch
+        self.version = f"easyocr-{_package_version('easyocr')}"
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self._reader = None
+        self._torch = None
+        self._lock = threading.Lock()
+        self._warmup_thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._reader is not None
+
+    def load(self):
+        if self._reader is not None:
+            return self._reader
+        with self._lock:
+            if self._reader is None:
+                started = time.perf_counter()
+                try:
+                    import easyocr
+                    import torch
+
+                    torch.set_num_threads(self.threads)
+                    try:
+                        torch.set_num_interop_threads(1)
+                    except RuntimeError:
+                        pass  # only allowed before the first parallel op; fine if someone got there first
+                    kwargs = {}
+                    if self.model_dir:
+                        kwargs.update(model_storage_directory=self.model_dir, download_enabled=False)
+                    onnx = self.runtime == "onnx"
+                    # ONNX export needs the fp32 modules; the quantization is then done by onnxruntime
+                    reader = easyocr.Reader(
+                        self.languages, gpu=False, quantize=self.quantize and not onnx, verbose=False, **kwargs
+                    )
+                    if onnx:
+                        self._use_onnx(reader, torch)
+                    self._torch = torch
+                    self._reader = reader
+                    self.error = None
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                finally:
+                    self.load_seconds = time.perf_counter() - started
+        return self._reader
+
+    def _use_onnx(self, reader, torch) -> None:
+        """Move the reader onto ONNX Runtime, or back to (quantized) torch if that fails."""
+        try:
+            import easyocr.easyocr
+            from ocr_onnx import use_onnx
+
+            tag = f"{self.version}-{reader.model_lang}"
+            height = getattr(easyocr.easyocr, "imgH", 64)
+            use_onnx(reader, OCR_ONNX_DIR, tag, self.threads, self.quantize, height)
+        except Exception as e:
+            print(f"ONNX Runtime unavailable, using torch: {e}")
+            self.runtime = "torch"
+            if self.quantize:
+                torch.quantization.quantize_dynamic(reader.detector, dtype=torch.qint8, inplace=True)
+                torch.quantization.quantize_dynamic(reader.recognizer, dtype=torch.qint8, inplace=True)
+
+    def _inference(self):
+        # Cheaper than the no_grad easyocr uses internally: no version counter bookkeeping
+        return self._torch.inference_mode() if self._torch is not None else contextlib.nullcontext()
+
+    def warm_up(self) -> None:
+        """Load the models on a background thread; safe to call more than once."""
+        if self.ready or (self._warmup_thread and self._warmup_thread.is_alive()):
+            return
+
+        def _load():
+            try:
+                self.load()
+            except Exception as e:
+                print(f"OCR warm-up failed: {e}")
+
+        self._warmup_thread = threading.Thread(target=_load, name="ocr-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    def readtext(self, image, **kwargs):
+        reader = self.load()
+        with self._inference():
+            return reader.readtext(image, **kwargs)
+
+    def detect_batched(self, images: list, batch_size: int = OCR_BATCH_SIZE) -> Tuple[List[list], List[dict]]:
+        """Run only the text detector over many page rasters.
+
+        easyocr can only stack images of identical shape into one detector
+        pass, so pages are grouped by shape (pages of one PDF rendered at the
+        same DPI usually share it, and preprocessing pads the ones it resizes
+        to a few common shapes) and each group is sent in chunks of
+        batch_size. Grey rasters are expanded to RGB for the detector. Returns the candidate boxes of every image, in input
+        order, and the input indexes and duration of every detector call.
+        """
+        reader = self.load()
+        groups = {}
+        for index, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(index)
+
+        boxes: List[list] = [[] for _ in images]
+        batches = []
+        for indexes in groups.values():
+            for start in range(0, len(indexes), batch_size):
+                chunk = indexes[start:start + batch_size]
+                started = time.perf_counter()
+                with self._inference():
+                    if len(chunk) == 1:
+                        horizontal, free = reader.detect(images[chunk[0]])
+                    else:
+                        horizontal, free = reader.detect(np.stack([_rgb(images[i]) for i in chunk]), reformat=False)
+                for index, h_list, f_list in zip(chunk, horizontal, free):
+                    boxes[index] = candidate_regions(h_list, f_list, images[index].shape[0])
+                batches.append({"indexes": chunk, "seconds": time.perf_counter() - started})
+        return boxes, batches
+
+    def recognize(
+        self,
+        image: np.ndarray,
+        boxes: list,
+        until: Optional[Callable[[List[str]], bool]] = None,
+        chunk_size: int = OCR_RECOGNIZE_CHUNK,
+    ) -> Tuple[List[str], bool, Optional[List[list]]]:
+        """Recognize the detected boxes of one raster in reading order.
+
+        Boxes are recognized chunk_size at a time; once until() accepts the
+        text read so far the rest of the page is skipped. Returns the texts,
+        whether every box was read, and the [x0, y0, x1, y1] box of each
+        text in raster pixels.
+        """
+        reader = self.load()
+        grey = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        texts: List[str] = []
+        locations: List[list] = []
+        for start in range(0, len(boxes), chunk_size):
+            chunk = boxes[start:start + chunk_size]
+            with self._inference():
+                results = reader.recognize(
+                    grey,
+                    [box for kind, box in chunk if kind == "horizontal"],
+                    [box for kind, box in chunk if kind == "free"],
+                    detail=1,
+                    reformat=False,
+                )
+            for points, text, _ in results:
+                xs, ys = [float(point[0]) for point in points], [float(point[1]) for point in points]
+                texts.append(text)
+                locations.append([min(xs), min(ys), max(xs), max(ys)])
+            if until is not None and until(texts):
+                return texts, start + chunk_size >= len(boxes), locations
+        return texts, True, locations
+
+    @property
+    def cache_tag(self) -> str:
+        # Everything the output of this engine depends on
+        quantized = ":int8" if self.quantize else ""
+        return f"{self.version}:{','.join(self.languages)}:{self.render_dpi}:{self.runtime}{quantized}"
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "loading": bool(self._warmup_thread and self._warmup_thread.is_alive()),
+            "languages": self.languages,
+            "version": self.version,
+            "model_dir": self.model_dir,
+            "runtime": self.runtime,
+            "quantized": self.quantize,
+            "threads": self.threads,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+class TesseractEngine:
+    """The fast backend: the tesseract binary through pytesseract.
+
+    It has no separate detector, so detect_batched() hands every raster on
+    as a single region and recognize() reads the whole raster in one call.
+    Nothing heavy is loaded in-process, which suits the shared-CPU machines.
+    """
+
+    name = "tesseract"
+    detect_stage = None
+    recognize_stage = "ocr_tesseract"
+
+    def __init__(self, languages: str = TESSERACT_LANGUAGES, config: str = TESSERACT_CONFIG):
+        self.languages = languages
+        self.config = config
+        self.render_dpi = TESSERACT_DPI
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self._binary_version: Optional[str] = None
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._module is not None
+
+    @property
+    def version(self) -> str:
+        if self._binary_version is None:
+            try:
+                self._binary_version = str(self.load().get_tesseract_version())
+            except Exception:
+                self._binary_version = "unknown"
+        return f"tesseract-{self._binary_version}"
+
+    def load(self):
+        if self._module is not None:
+            return self._module
+        with self._lock:
+            if self._module is None:
+                started = time.perf_counter()
+                try:
+                    import pytesseract
+
+                    pytesseract.get_tesseract_version()  # fails early when the binary is missing
+                    self._module = pytesseract
+                    self.error = None
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                finally:
+                    self.load_seconds = time.perf_counter() - started
+        return self._module
+
+    def warm_up(self) -> None:
+        try:
+            self.load()
+        except Exception as e:
+            print(f"Tesseract unavailable: {e}")
+
+    def detect_batched(self, images: list, batch_size: int = OCR_BATCH_SIZE) -> Tuple[List[list], List[dict]]:
+        return [[("page", None)] for _ in images], []
+
+    def recognize(
+        self,
+        image: np.ndarray,
+        boxes: list,
+        until: Optional[Callable[[List[str]], bool]] = None,
+        chunk_size: int = OCR_RECOGNIZE_CHUNK,
+    ) -> Tuple[List[str], bool, Optional[List[list]]]:
+        # image_to_string gives no positions
+        text = self.load().image_to_string(image, lang=self.languages, config=self.config)
+        return [line.strip() for line in text.splitlines() if line.strip()], True, None
+
+    @property
+    def cache_tag(self) -> str:
+        return f"{self.version}:{self.languages}:{self.render_dpi}:{self.config}"
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "languages": self.languages,
+            "version": self.version if self.ready else None,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+class RemoteOCREngine(OCREngine):
+    """easyocr through the shared OCR server (see ocr_server.py).
+
+    With several API worker processes each would otherwise load torch and
+    both models; the server loads them once and batches the detector calls
+    of all workers. Settings that end up in cache_tag are read from the same
+    environment as the server's. When there is an until() to check, boxes
+    are sent to the recognizer a chunk at a time so pages still stop early.
+    """
+
+    def __init__(self, address: str = OCR_SERVER_SOCKET, timeout: float = OCR_SERVER_TIMEOUT, **kwargs):
+        super().__init__(**kwargs)
+        self.address = address
+        self.timeout = timeout
+        self._remote_status: dict = {}
+        self._idle: list = []
+        self._idle_lock = threading.Lock()
+
+    def _call(self, *request, timeout: Optional[float] = None):
+        with self._idle_lock:
+            connection = self._idle.pop() if self._idle else None
+        try:
+            if connection is None:
+                connection = Client(self.address, family="AF_UNIX", authkey=OCR_SERVER_KEY)
+            connection.send(request)
+            if not connection.poll(timeout or self.timeout):
+                raise TimeoutError(f"OCR server did not answer {request[0]} in time")
+            status, result = connection.recv()
+        except Exception:
+            if connection is not None:
+                connection.close()
+            raise
+        with self._idle_lock:
+            self._idle.append(connection)
+        if status == "error":
+            raise RuntimeError(result)
+        return result
+
+    def _refresh(self, status: dict) -> None:
+        self._remote_status = status
+        self.load_seconds = status.get("load_seconds")
+        self.error = status.get("error")
+
+    @property
+    def ready(self) -> bool:
+        if not self._remote_status.get("ready"):
+            try:
+                self._refresh(self._call("status", timeout=1))
+            except Exception as e:
+                self.error = f"OCR server unavailable: {e}"
+        return bool(self._remote_status.get("ready"))
+
+    def load(self):
+        if not self.ready:
+            self._refresh(self._call("load"))
+        return self
+
+    def readtext(self, image, **kwargs):
+        return self._call("readtext", image, kwargs)
+
+    def detect_batched(self, images: list, batch_size: int = OCR_BATCH_SIZE) -> Tuple[List[list], List[dict]]:
+        return self._call("detect", images)
+
+    def recognize(
+        self,
+        image: np.ndarray,
+        boxes: list,
+        until: Optional[Callable[[List[str]], bool]] = None,
+        chunk_size: int = OCR_RECOGNIZE_CHUNK,
+    ) -> Tuple[List[str], bool, Optional[List[list]]]:
+        if until is None:
+            return self._call("recognize", image, boxes)
+        texts: List[str] = []
+        locations: List[list] = []
+        for start in range(0, len(boxes), chunk_size):
+            chunk_texts, _, chunk_locations = self._call("recognize", image, boxes[start:start + chunk_size])
+            texts += chunk_texts
+            locations += chunk_locations
+            if until(texts):
+                return texts, start + chunk_size >= len(boxes), locations
+        return texts, True, locations
+
+    def status(self) -> dict:
+        ready = self.ready
+        return {**self._remote_status, "ready": ready, "server": self.address, "error": self.error}
+
+
+ocr_engine = RemoteOCREngine() if OCR_SERVER_SOCKET else OCREngine()
+tesseract_engine = TesseractEngine()
+OCR_ENGINES = {engine.name: engine for engine in (ocr_engine, tesseract_engine)}
+
+# Engines tried in order; a later one only reads what the earlier ones missed
+POLICIES = {
+    "easyocr": ("easyocr",),
+    "tesseract": ("tesseract",),
+    "fast-first": ("tesseract", "easyocr"),
+}
+
+
+def ocr_policy(name: Optional[str] = None) -> str:
+    """The OCR policy for an upload field, falling back to OCR_POLICY."""
+    policy = OCR_POLICIES.get(name, OCR_POLICY) if name else OCR_POLICY
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown OCR policy: {policy}")
+    return policy
+
+
+def policy_engines(policy: str) -> List:
+    return [OCR_ENGINES[name] for name in POLICIES[policy]]
+
+
+def engines_in_use() -> List:
+    """Every engine some configured policy may call."""
+    names = {name for policy in {OCR_POLICY, *OCR_POLICIES.values()} for name in POLICIES.get(policy, ())}
+    return [engine for engine in OCR_ENGINES.values() if engine.name in names]
@@ -0,0 +1,133 @@
+# ONNX Runtime backend for the easyocr models, used when OCR_RUNTIME=onnx.
+# onnxruntime is an optional dependency and only imported from here.
+import os
+from typing import List
+
+
+class OnnxModule:
+    """Stands in for one of easyocr's torch modules, running an ONNX Runtime session.
+
+    easyocr calls its detector as net(x) -> (scores, features) and its
+    recognizer as model(image, text) -> preds, with tensors in and out; this
+    keeps that contract so the rest of easyocr is untouched.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.inputs: List[str] = [i.name for i in session.get_inputs()]
+
+    def __call__(self, *tensors):
+        import torch
+
+        feeds = {name: tensor.detach().cpu().numpy() for name, tensor in zip(self.inputs, tensors)}
+        outputs = [torch.from_numpy(output) for output in self.session.run(None, feeds)]
+        return outputs[0] if len(outputs) == 1 else tuple(outputs)
+
+    def eval(self):
+        return self
+
+
+def _export(*args, **kwargs) -> None:
+    import inspect
+
+    import torch
+
+    # Newer torch defaults to the dynamo exporter, which cannot take these
+    # models; torch 2.0 (requirements.txt) only has the TorchScript one and no dynamo parameter
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+    torch.onnx.export(*args, **kwargs)
+
+
+def export_detector(detector, path: str) -> None:
+    import torch
+
+    _export(
+        detector, (torch.zeros(1, 3, 64, 64),), path,
+        input_names=["image"], output_names=["scores", "features"],
+        dynamic_axes={
+            "image": {0: "batch", 2: "height", 3: "width"},
+            "scores": {0: "batch", 1: "score_height", 2: "score_width"},
+            "features": {0: "batch", 2: "feature_height", 3: "feature_width"},
+        },
+        opset_version=13,
+    )
+
+
+def export_recognizer(recognizer, path: str, height: int = 64) -> None:
+    import torch
+
+    class MeanPool(torch.nn.Module):
+        # AdaptiveAvgPool2d((None, 1)) with a dynamic width cannot be exported;
+        # over the fixed-height axis it is just a mean
+        def forward(self, x):
+            return x.mean(dim=3, keepdim=True)
+
+    image = torch.zeros(1, 1, height, 128)
+    text = torch.zeros(1, 26, dtype=torch.long)  # unused by the CTC models
+    pool = getattr(recognizer, "AdaptiveAvgPool", None)
+    if pool is not None:
+        recognizer.AdaptiveAvgPool = MeanPool()
+    try:
+        _export(
+            recognizer, (image, text), path,
+            input_names=["image", "text"], output_names=["preds"],
+            dynamic_axes={"image": {0: "batch", 3: "width"}, "text": {0: "batch"}, "preds": {0: "batch", 1: "steps"}},
+            opset_version=13,
+        )
+    finally:
+        if pool is not None:
+            recognizer.AdaptiveAvgPool = pool
+
+
+def quantize_model(path: str) -> str:
+    """Dynamic int8 copy of an exported model, next to it.
+
+    Only the LSTM and linear layers are quantized, like torch's
+    quantize_dynamic does: int8 convolutions (ConvInteger) are several
+    times slower than fp32 ones on CPU.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantized = path.replace(".onnx", ".int8.onnx")
+    if not os.path.exists(quantized):
+        quantize_dynamic(
+            path, quantized + ".tmp", weight_type=QuantType.QInt8, op_types_to_quantize=["LSTM", "MatMul", "Gemm"]
+        )
+        os.replace(quantized + ".tmp", quantized)
+    return quantized
+
+
+def make_session(path: str, threads: int):
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+def use_onnx(reader, directory: str, tag: str, threads: int, quantize: bool, height: int = 64) -> None:
+    """Swap the reader's torch detector and recognizer for ONNX Runtime sessions.
+
+    The models are exported once into directory (from the fp32 weights, so
+    the reader must be created with quantize=False) and reused afterwards.
+    Only the recognizer is quantized; the detector is all convolutions.
+    """
+    import onnxruntime  # noqa: F401 -- fail before exporting anything
+
+    os.makedirs(directory, exist_ok=True)
+    detector_path = os.path.join(directory, f"{tag}-detector.onnx")
+    recognizer_path = os.path.join(directory, f"{tag}-recognizer.onnx")
+    if not os.path.exists(detector_path):
+        export_detector(reader.detector, detector_path + ".tmp")
+        os.replace(detector_path + ".tmp", detector_path)
+    if not os.path.exists(recognizer_path):
+        export_recognizer(reader.recognizer, recognizer_path + ".tmp", height)
+        os.replace(recognizer_path + ".tmp", recognizer_path)
+    if quantize:
+        recognizer_path = quantize_model(recognizer_path)
+
+    reader.detector = OnnxModule(make_session(detector_path, threads))
+    reader.recognizer = OnnxModule(make_session(recognizer_path, threads))
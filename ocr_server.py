@@ -0,0 +1,195 @@
+"""Shared OCR server: one process owns the easyocr models for every API worker.
+
+    python -m ocr_server --socket /tmp/ocr.sock
+
+API workers started with OCR_SERVER_SOCKET pointing at the socket use
+ocr.RemoteOCREngine instead of loading torch themselves. serve.py starts
+the server and the workers together.
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+from typing import List, Optional
+
+from ocr import OCR_BATCH_SIZE, OCR_SERVER_KEY, OCREngine
+
+
+# How long the first detector request waits for others to share its batch;
+# only while more than one worker is connected
+OCR_SERVER_BATCH_WAIT = float(os.getenv("OCR_SERVER_BATCH_WAIT", "0.01"))
+REQUESTS = ("detect", "recognize", "readtext")
+
+
+class _Job:
+    def __init__(self, kind: str, args: tuple):
+        self.kind = kind
+        self.args = args
+        self.reply: Optional[tuple] = None
+        self.done = threading.Event()
+
+    def finish(self, reply: tuple) -> None:
+        self.reply = reply
+        self.done.set()
+
+
+class OCRServer:
+    """Serves OCREngine calls from other processes over a unix socket.
+
+    Each connection gets a thread that queues its requests; a single
+    dispatcher thread runs them, so the models are used by one call at a
+    time with all of OCR_THREADS. Detector requests that arrive together
+    are merged into one detect_batched() call.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        engine: Optional[OCREngine] = None,
+        batch_size: int = OCR_BATCH_SIZE,
+        batch_wait: float = OCR_SERVER_BATCH_WAIT,
+    ):
+        self.address = address
+        self.engine = engine or OCREngine()
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.jobs: "queue.Queue[_Job]" = queue.Queue()
+        self.connections = 0
+        self.requests = 0
+        self.batched = 0
+
+    def serve_forever(self) -> None:
+        if os.path.exists(self.address):
+            os.unlink(self.address)  # left by a previous run
+        listener = Listener(self.address, family="AF_UNIX", authkey=OCR_SERVER_KEY)
+        os.chmod(self.address, 0o600)
+        threading.Thread(target=self._dispatch, name="ocr-dispatch", daemon=True).start()
+        self.engine.warm_up()
+        print(f"OCR server listening on {self.address}")
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, OSError) as e:
+                    print(f"OCR server refused a connection: {e}")
+                    continue
+                threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+        finally:
+            listener.close()
+
+    def status(self) -> dict:
+        return {
+            **self.engine.status(),
+            "cache_tag": self.engine.cache_tag,
+            "connections": self.connections,
+            "requests": self.requests,
+            "batched_requests": self.batched,
+        }
+
+    def _serve(self, connection) -> None:
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    kind, *args = connection.recv()
+                except (EOFError, OSError):
+                    return
+                if kind == "status":
+                    reply = ("ok", self.status())
+                elif kind == "load":
+                    try:
+                        self.engine.load()
+                        reply = ("ok", self.status())
+                    except Exception as e:
+                        reply = ("error", str(e))
+                elif kind in REQUESTS:
+                    job = _Job(kind, tuple(args))
+                    self.jobs.put(job)
+                    job.done.wait()
+                    reply = job.reply
+                else:
+                    reply = ("error", f"Unknown request: {kind}")
+                try:
+                    connection.send(reply)
+                except OSError:
+                    return  # the worker gave up waiting
+        finally:
+            self.connections -= 1
+            connection.close()
+
+    def _dispatch(self) -> None:
+        while True:
+            job = self.jobs.get()
+            self.requests += 1
+            if job.kind != "detect":
+                self._run(job)
+                continue
+            jobs, deferred = [job], []
+            images = len(job.args[0])
+            deadline = time.monotonic() + (self.batch_wait if self.connections > 1 else 0)
+            while images < self.batch_size:
+                try:
+                    other = self.jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                self.requests += 1
+                if other.kind == "detect":
+                    jobs.append(other)
+                    images += len(other.args[0])
+                else:
+                    deferred.append(other)
+            self._detect(jobs)
+            for other in deferred:
+                self._run(other)
+
+    def _run(self, job: _Job) -> None:
+        try:
+            if job.kind == "readtext":
+                image, kwargs = job.args
+                job.finish(("ok", self.engine.readtext(image, **kwargs)))
+            else:
+                job.finish(("ok", getattr(self.engine, job.kind)(*job.args)))
+        except Exception as e:
+            job.finish(("error", str(e)))
+
+    def _detect(self, jobs: List[_Job]) -> None:
+        """One detector call for the images of several requests, split back per request."""
+        if len(jobs) > 1:
+            self.batched += len(jobs)
+        images = [image for job in jobs for image in job.args[0]]
+        try:
+            boxes, batches = self.engine.detect_batched(images, self.batch_size)
+        except Exception as e:
+            for job in jobs:
+                job.finish(("error", str(e)))
+            return
+        start = 0
+        for job in jobs:
+            end = start + len(job.args[0])
+            job_batches = []
+            for batch in batches:
+                indexes = [index - start for index in batch["indexes"] if start <= index < end]
+                if indexes:
+                    # The requester's share of a call it had with others
+                    seconds = batch["seconds"] * len(indexes) / len(batch["indexes"])
+                    job_batches.append({"indexes": indexes, "seconds": seconds})
+            job.finish(("ok", (boxes[start:end], job_batches)))
+            start = end
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Shared OCR server for the API workers")
+    parser.add_argument("--socket", default=os.getenv("OCR_SERVER_SOCKET", "/tmp/ocr.sock"))
+    parser.add_argument(
+        "--threads", type=int, default=int(os.getenv("OCR_THREADS", "0")) or os.cpu_count() or 1,
+        help="torch threads; calls run one at a time, so all cores by default",
+    )
+    args = parser.parse_args(argv)
+    OCRServer(args.socket, OCREngine(threads=args.threads)).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
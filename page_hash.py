@@ -0,0 +1,68 @@
+import hashlib
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import registry
+
+
+# Reuse the OCR text of pixel-identical page rasters within one request or dossier
+OCR_PAGE_HASH = os.getenv("OCR_PAGE_HASH", "1") == "1"
+
+lookups = registry.counter("ocr_page_hash_lookups_total", "Pages checked against the page hash index, by result")
+
+_totals = {"hits": 0, "misses": 0}
+
+
+def page_digest(image: np.ndarray) -> str:
+    """Digest of a full-resolution page raster; equal only for pixel-identical rasters."""
+    digest = hashlib.sha256(repr(image.shape).encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+class PageHashIndex:
+    """OCR text of the page rasters read in one OCR pass, found by their exact content.
+
+    Pages repeated within a dossier (boilerplate terms, a second copy of an
+    ID card) and re-exported copies of a page have new PDF bytes, so the
+    extraction cache misses them, but their rasters are often identical.
+    Text is only reused for a raster that is identical pixel for pixel: a
+    page that merely looks the same may be the same form filled in for
+    someone else. Entries are kept per scope (one request, or one dossier
+    of a bulk run) and live only as long as the index, so no page is ever
+    read from another user's upload.
+    """
+
+    def __init__(self):
+        # (scope, engine tag, digest) -> (texts, text boxes or None)
+        self._entries: Dict[tuple, Tuple[List[str], Optional[List[list]]]] = {}
+
+    def lookup(
+        self, scope: Optional[str], digest: str, tag: str, count_miss: bool = True
+    ) -> Optional[Tuple[List[str], Optional[List[list]]]]:
+        """The OCR texts and text boxes of an identical page of this scope read with the same settings, or None."""
+        found = self._entries.get((scope, tag, digest))
+        if found is not None:
+            _totals["hits"] += 1
+            lookups.inc(result="hit")
+            return list(found[0]), found[1]
+        if count_miss:
+            _totals["misses"] += 1
+            lookups.inc(result="miss")
+        return None
+
+    def add(
+        self, scope: Optional[str], digest: str, tag: str, texts: List[str], boxes: Optional[List[list]] = None
+    ) -> None:
+        self._entries[(scope, tag, digest)] = (list(texts), boxes)
+
+
+def stats() -> dict:
+    lookups_total = _totals["hits"] + _totals["misses"]
+    return {
+        "hits": _totals["hits"],
+        "misses": _totals["misses"],
+        "hit_rate": round(_totals["hits"] / lookups_total, 3) if lookups_total else None,
+    }
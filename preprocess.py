@@ -0,0 +1,235 @@
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from metrics import span
+
+
+# Steps applied to every raster before OCR, in pipeline order; "" turns preprocessing off
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "grayscale,crop,rotate,downscale,deskew,contrast")
+# Median glyph height (pixels) that larger text is scaled down to
+OCR_TEXT_HEIGHT = int(os.getenv("OCR_TEXT_HEIGHT", "24"))
+OCR_MAX_SKEW = float(os.getenv("OCR_MAX_SKEW", "10"))
+# Rasters whose shape changed are padded up to a multiple of this, so pages
+# of different sizes still share detector batches (see OCREngine.detect_batched)
+OCR_SHAPE_STEP = int(os.getenv("OCR_SHAPE_STEP", "64"))
+
+# Layout analysis runs on a copy at most this large
+ANALYSIS_SIZE = 1024
+CROP_PADDING = 16
+MIN_INK_PIXELS = 200
+# How much stronger the column profile must be before a page is taken for sideways
+SIDEWAYS_RATIO = 2.0
+# How much more ink below the lines' x-height band than above it before a page is taken for upside down
+UPSIDE_DOWN_RATIO = 1.5
+MIN_LINES = 3
+
+
+def _gray(image: np.ndarray) -> np.ndarray:
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+
+def _ink(image: np.ndarray) -> Tuple[Optional[np.ndarray], float]:
+    """Ink mask of a downsized copy and its scale, or None for a blank raster."""
+    gray = _gray(image)
+    scale = min(1.0, ANALYSIS_SIZE / max(gray.shape))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if int(gray.max()) - int(gray.min()) < 32:
+        return None, scale
+    _, mask = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    if np.count_nonzero(mask) < MIN_INK_PIXELS:
+        return None, scale
+    return mask, scale
+
+
+def _lines(mask: np.ndarray) -> List[Tuple[int, int]]:
+    """Row ranges of the text lines of a mask, from its horizontal projection."""
+    rows = mask.sum(axis=1) > max(1, mask.shape[1] // 200)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], rows.astype(np.int8), [0]))))
+    return [(start, end) for start, end in zip(edges[::2], edges[1::2]) if end - start >= 4]
+
+
+def _profile_contrast(profile: np.ndarray) -> float:
+    mean = profile.mean()
+    return float(profile.var() / (mean * mean)) if mean else 0.0
+
+
+def grayscale(image: np.ndarray) -> np.ndarray:
+    # render_page already renders grey when this step is on; this covers other rasters
+    return _gray(image)
+
+
+def crop(image: np.ndarray) -> np.ndarray:
+    """Cut the blank margins, keeping CROP_PADDING pixels around the ink."""
+    mask, scale = _ink(image)
+    if mask is None:
+        return image
+    rows = np.flatnonzero(mask.sum(axis=1) > 1)
+    cols = np.flatnonzero(mask.sum(axis=0) > 1)
+    if not rows.size or not cols.size:
+        return image
+    height, width = image.shape[:2]
+    top = max(0, int(rows[0] / scale) - CROP_PADDING)
+    bottom = min(height, int((rows[-1] + 1) / scale) + CROP_PADDING)
+    left = max(0, int(cols[0] / scale) - CROP_PADDING)
+    right = min(width, int((cols[-1] + 1) / scale) + CROP_PADDING)
+    return image[top:bottom, left:right]
+
+
+def rotate(image: np.ndarray) -> np.ndarray:
+    """Turn sideways and upside-down pages upright.
+
+    Text lines make the row profile of a page far more uneven than its
+    column profile; a sideways page is the other way round. Latin text has
+    more ascenders and capitals than descenders, so upright lines carry
+    more ink above their x-height band (the rows holding at least half the
+    line's peak ink) than below it.
+    """
+    mask, _ = _ink(image)
+    if mask is None:
+        return image
+    turns = 0
+    if _profile_contrast(mask.sum(axis=0)) > SIDEWAYS_RATIO * _profile_contrast(mask.sum(axis=1)):
+        mask = np.rot90(mask)
+        turns = 1
+    lines = _lines(mask)
+    if len(lines) >= MIN_LINES:
+        top = bottom = 0
+        for start, end in lines:
+            profile = mask[start:end].sum(axis=1)
+            band = np.flatnonzero(profile * 2 >= profile.max())
+            top += int(profile[:band[0]].sum())
+            bottom += int(profile[band[-1] + 1:].sum())
+        if bottom > UPSIDE_DOWN_RATIO * top:
+            turns += 2
+    elif turns:
+        return image  # too little text to tell which way it is turned
+    return np.ascontiguousarray(np.rot90(image, turns)) if turns else image
+
+
+def downscale(image: np.ndarray) -> np.ndarray:
+    """Scale the raster down until the median glyph is OCR_TEXT_HEIGHT pixels high."""
+    mask, scale = _ink(image)
+    if mask is None:
+        return image
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    # Glyphs, not specks, rules, photos or letters merged into a line
+    glyphs = (heights >= 3) & (heights < mask.shape[0] // 5) & (widths < 4 * heights)
+    if np.count_nonzero(glyphs) < 10:
+        return image
+    text_height = float(np.median(heights[glyphs])) / scale
+    if text_height <= OCR_TEXT_HEIGHT:
+        return image
+    factor = OCR_TEXT_HEIGHT / text_height
+    return cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+
+def skew_angle(mask: np.ndarray, max_skew: float = OCR_MAX_SKEW) -> float:
+    """The rotation (degrees, as cv2.getRotationMatrix2D takes it) that levels the text lines of a mask.
+
+    Ink pixels are projected onto the vertical axis at every candidate
+    angle at once; the angle whose projection has the sharpest peaks wins.
+    """
+    ys, xs = np.nonzero(mask)
+    step = max(1, len(ys) // 20000)
+    ys, xs = ys[::step].astype(np.float32), xs[::step].astype(np.float32)
+    best = 0.0
+    for spread, resolution in ((max_skew, 0.5), (0.5, 0.1)):
+        angles = best + np.arange(-spread, spread + resolution / 2, resolution, dtype=np.float32)
+        radians = np.deg2rad(angles)[:, None]
+        projected = ys[None, :] * np.cos(radians) - xs[None, :] * np.sin(radians)
+        bins = (projected - projected.min()).astype(np.int64)
+        size = int(bins.max()) + 1
+        counts = np.bincount((bins + np.arange(len(angles))[:, None] * size).ravel(), minlength=len(angles) * size)
+        scores = np.square(counts.reshape(len(angles), size).astype(np.float64)).sum(axis=1)
+        best = float(angles[int(np.argmax(scores))])
+    return best
+
+
+def deskew(image: np.ndarray) -> np.ndarray:
+    """Rotate by the small angle that levels the text lines."""
+    mask, _ = _ink(image)
+    if mask is None:
+        return image
+    angle = skew_angle(mask)
+    if abs(angle) < 0.2:
+        return image
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    white = 255 if image.ndim == 2 else (255,) * image.shape[2]
+    return cv2.warpAffine(image, matrix, (width, height), flags=cv2.INTER_LINEAR, borderValue=white)
+
+
+def contrast(image: np.ndarray) -> np.ndarray:
+    """Stretch the 1st-99th percentile of the grey levels over the full range."""
+    gray = _gray(image)
+    scale = min(1.0, ANALYSIS_SIZE / max(gray.shape))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    low, high = np.percentile(gray, (1, 99))
+    if high - low < 32 or (low <= 8 and high >= 247):
+        return image  # blank, or already using the full range
+    table = np.clip((np.arange(256) - low) * 255.0 / (high - low), 0, 255).astype(np.uint8)
+    return cv2.LUT(image, table)
+
+
+STEPS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "grayscale": grayscale,
+    "crop": crop,
+    "rotate": rotate,
+    "downscale": downscale,
+    "deskew": deskew,
+    "contrast": contrast,
+}
+
+
+def pad(image: np.ndarray, step: int = OCR_SHAPE_STEP) -> np.ndarray:
+    height, width = image.shape[:2]
+    bottom, right = -height % step, -width % step
+    if not bottom and not right:
+        return image
+    white = 255 if image.ndim == 2 else (255,) * image.shape[2]
+    return cv2.copyMakeBorder(image, 0, bottom, 0, right, cv2.BORDER_CONSTANT, value=white)
+
+
+class Preprocessor:
+    """Prepares page rasters for OCR, straight on the rendered pixel arrays.
+
+    Each step of OCR_PREPROCESS is timed as its own stage
+    (preprocess_<step>). Steps never upscale and leave blank rasters alone.
+    """
+
+    def __init__(self, steps: str = OCR_PREPROCESS):
+        self.steps = [step.strip() for step in steps.split(",") if step.strip()]
+        unknown = [step for step in self.steps if step not in STEPS]
+        if unknown:
+            raise ValueError(f"Unknown OCR_PREPROCESS steps: {', '.join(unknown)}")
+        self.steps.sort(key=list(STEPS).index)
+
+    @property
+    def grayscale(self) -> bool:
+        return "grayscale" in self.steps
+
+    @property
+    def cache_tag(self) -> str:
+        # Everything the prepared rasters, and so the OCR output, depend on
+        if not self.steps:
+            return "raw"
+        return f"{'+'.join(self.steps)}:{OCR_TEXT_HEIGHT}:{OCR_MAX_SKEW:g}:{OCR_SHAPE_STEP}"
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        shape = image.shape
+        for step in self.steps:
+            with span(f"preprocess_{step}"):
+                image = STEPS[step](image)
+        if image.shape != shape:
+            image = pad(image)
+        return np.ascontiguousarray(image)
+
+
+preprocessor = Preprocessor()
@@ -0,0 +1,130 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from extraction import ExtractedDocument, extract_document, ocr_documents, page_budget
+from metrics import document_seconds, validation_errors
+from ocr import ocr_policy
+from utils import required_fields, uses_layout
+
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "4"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "1"))
+DOCUMENT_TIMEOUT = float(os.getenv("DOCUMENT_TIMEOUT", "120"))
+
+
+def _field(name) -> str:
+    return name[-1] if isinstance(name, tuple) else name
+
+
+class ValidationScheduler:
+    """Runs document validations off the event loop.
+
+    PyMuPDF parsing and the regex validators go to a thread pool; OCR goes to
+    its own, smaller pool so that one scanned upload cannot starve the cheap
+    text-layer work of the other documents. easyocr shares one model between
+    the OCR threads (torch releases the GIL during inference), which keeps the
+    memory footprint of a single model on the 1 GB machine.
+    """
+
+    def __init__(
+        self,
+        pdf_workers: int = PDF_WORKERS,
+        ocr_workers: int = OCR_WORKERS,
+        timeout: Optional[float] = DOCUMENT_TIMEOUT,
+    ):
+        self.pdf_pool = ThreadPoolExecutor(max_workers=pdf_workers, thread_name_prefix="pdf")
+        self.ocr_pool = ThreadPoolExecutor(max_workers=ocr_workers, thread_name_prefix="ocr")
+        self.timeout = timeout
+
+    async def run(
+        self,
+        jobs: Dict[Any, Tuple[Any, Callable[..., dict], dict]],
+        on_result: Optional[Callable[[Any, dict], None]] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[Dict[Any, dict], Dict[Any, ExtractedDocument]]:
+        """Validate every job concurrently and wait for all of them.
+
+        jobs maps an upload name to (PDF bytes or ingested upload, validator,
+        validator kwargs); on_result, if given, is called with each name and
+        result as soon as that document is done. Text layers are read in parallel, then the image pages of all scanned
+        documents go through one batched OCR pass while the text-layer
+        documents are already being validated. A document that is not done
+        within the timeout gets an error result while the others are still
+        returned, so the response is never all-or-nothing.
+
+        Jobs are keyed by upload field, or by (dossier, upload field) to
+        validate several dossiers in one pass (see bulk.py). timeout
+        overrides the scheduler's for this call.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else started + timeout
+        documents: Dict[str, ExtractedDocument] = {}
+        results: Dict[str, dict] = {}
+
+        async def guarded(coro):
+            try:
+                remaining = None if deadline is None else max(0.0, deadline - loop.time())
+                return await asyncio.wait_for(coro, timeout=remaining)
+            except asyncio.TimeoutError:
+                return {"error": f"Validation timed out after {timeout:g}s"}
+            except Exception as e:
+                return {"error": str(e)}
+
+        def in_pool(pool, function, *args, **kwargs):
+            # Run in a copy of this context so the worker's timing spans reach the request
+            context = contextvars.copy_context()
+            return loop.run_in_executor(pool, partial(context.run, function, *args, **kwargs))
+
+        def publish(name, outcome):
+            results[name] = outcome
+            document_seconds.observe(loop.time() - started, document=_field(name))
+            if isinstance(outcome, dict) and "error" in outcome:
+                validation_errors.inc(document=_field(name))
+            if on_result is not None:
+                on_result(name, outcome)
+
+        async def extract(name):
+            source, validator, kwargs = jobs[name]
+            # Reading this document may stop once the validator's fields are found
+            until = required_fields(validator, kwargs)
+            documents[name] = await in_pool(
+                self.pdf_pool, extract_document, source,
+                ocr=False, until=until, ocr_policy=ocr_policy(_field(name)), max_pages=page_budget(_field(name)),
+                layout=uses_layout(validator),
+            )
+            # Identical pages of one dossier share their OCR text, never those of two dossiers
+            documents[name].scope = str(name[0]) if isinstance(name, tuple) else None
+
+        async def validate(name):
+            document = documents[name]
+            if ocr_task is not None and document.needs_ocr:
+                await asyncio.shield(ocr_task)
+            _, validator, kwargs = jobs[name]
+            return await in_pool(self.pdf_pool, validator, document, **kwargs)
+
+        async def finish(name):
+            publish(name, await guarded(validate(name)))
+
+        # Text layers first: cheap, and they tell which documents need OCR
+        names = list(jobs)
+        for name, outcome in zip(names, await asyncio.gather(*(guarded(extract(name)) for name in names))):
+            if outcome is not None:
+                publish(name, outcome)
+
+        # One OCR batch for all scanned documents; text documents validate meanwhile
+        pending = [document for document in documents.values() if document.needs_ocr and not document.satisfied]
+        ocr_task = in_pool(self.ocr_pool, ocr_documents, pending) if pending else None
+
+        await asyncio.gather(*(finish(name) for name in names if name not in results))
+        return {name: results[name] for name in names}, documents
+
+    def shutdown(self) -> None:
+        # Threads cannot be interrupted; timed-out work finishes in the background
+        self.pdf_pool.shutdown(wait=False)
+        self.ocr_pool.shutdown(wait=False)
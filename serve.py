@@ -0,0 +1,68 @@
+"""Start the API, sharing one OCR server between the workers when there are several.
+
+    WEB_CONCURRENCY=4 python serve.py
+
+With one worker this is just uvicorn. With more, the easyocr models are
+loaded once, by ocr_server.py, and every uvicorn worker sends its OCR work
+there over a unix socket instead of loading its own copy of torch. Exits
+when either process does, taking the other one down with it.
+"""
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = os.getenv("PORT", "8000")
+OCR_SERVER_SOCKET = os.getenv("OCR_SERVER_SOCKET", "/tmp/ocr.sock")
+OCR_SERVER_STARTUP = float(os.getenv("OCR_SERVER_STARTUP", "30"))
+
+
+def wait_for_socket(path: str, server: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path) and server.poll() is None and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+
+def main() -> int:
+    from ocr import engines_in_use
+
+    processes = []
+    env = dict(os.environ)
+    # Sibling workers leave each other's jobs alone when resuming (see jobs.orphaned)
+    env["JOB_LAUNCH"] = uuid.uuid4().hex
+    if WEB_CONCURRENCY > 1 and any(engine.name == "easyocr" for engine in engines_in_use()):
+        if os.path.exists(OCR_SERVER_SOCKET):
+            os.unlink(OCR_SERVER_SOCKET)  # so the wait below sees the new server's socket
+        server = subprocess.Popen([sys.executable, "-m", "ocr_server", "--socket", OCR_SERVER_SOCKET], env=env)
+        processes.append(server)
+        wait_for_socket(OCR_SERVER_SOCKET, server, OCR_SERVER_STARTUP)
+        env["OCR_SERVER_SOCKET"] = OCR_SERVER_SOCKET
+        # Jobs must be visible to whichever worker answers GET /jobs/{id}
+        env.setdefault("JOB_STORE", "sqlite")
+    processes.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", HOST, "--port", PORT,
+         "--workers", str(WEB_CONCURRENCY)],
+        env=env,
+    ))
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while all(process.poll() is None for process in processes):
+        time.sleep(0.5)
+    stop(None, None)
+    codes = [process.wait() for process in processes]
+    return next((code for code in codes if code), 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from ingest import IngestedFile
+
+
+# Directory of the content-addressed document store; unset disables it
+DOCUMENT_STORE_DIR = os.getenv("DOCUMENT_STORE_DIR")
+DOCUMENT_STORE_TTL = float(os.getenv("DOCUMENT_STORE_TTL_DAYS", "30")) * 86400
+DOCUMENT_STORE_MAX_BYTES = int(os.getenv("DOCUMENT_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Eviction runs on writes, at most this often
+DOCUMENT_STORE_SWEEP_SECONDS = float(os.getenv("DOCUMENT_STORE_SWEEP_SECONDS", "60"))
+INDEX_NAME = "index.sqlite3"
+
+
+def index_path(directory: Optional[str] = DOCUMENT_STORE_DIR) -> Optional[str]:
+    return os.path.join(directory, INDEX_NAME) if directory else None
+
+
+def _params_hash(kwargs: dict) -> str:
+    return hashlib.sha256(json.dumps(kwargs, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class DocumentStore:
+    """Uploaded PDFs kept by content hash, with an SQLite index.
+
+    Files live at <dir>/<sha256[:2]>/<sha256>.pdf. The index lists every
+    document with its size and page counts, and the validator results it
+    got for each set of form values. Extracted pages (classification and
+    text) are kept by the extraction cache, whose SQLite tier defaults to
+    the same index file, so a document validated again with other form
+    values is never parsed or OCR'd again. Documents unused for longer than
+    the TTL, and the least recently used ones once the store is over its
+    size limit, are deleted together with their results and extractions.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ttl: float = DOCUMENT_STORE_TTL,
+        max_bytes: int = DOCUMENT_STORE_MAX_BYTES,
+        sweep_seconds: float = DOCUMENT_STORE_SWEEP_SECONDS,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_seconds = sweep_seconds
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # WAL lets several API worker processes read while one writes
+        self._db = sqlite3.connect(index_path(directory), check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL, page_count INTEGER NOT NULL,
+                image_pages INTEGER NOT NULL, field TEXT, stored REAL NOT NULL, used REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                sha256 TEXT NOT NULL, field TEXT NOT NULL, params TEXT NOT NULL,
+                kwargs TEXT NOT NULL, result TEXT NOT NULL, created REAL NOT NULL,
+                PRIMARY KEY (sha256, field, params)
+            );
+            CREATE INDEX IF NOT EXISTS documents_used ON documents (used);
+            """
+        )
+        self._db.commit()
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.directory, sha256[:2], f"{sha256}.pdf")
+
+    def save(self, name: str, ingested: IngestedFile) -> None:
+        """Keep a copy of an upload; a document already stored is only touched."""
+        path = self.path(ingested.sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            if ingested.path is not None:
+                shutil.copyfile(ingested.path, partial)
+            else:
+                with open(partial, "wb") as f:
+                    f.write(ingested.data)
+            os.replace(partial, path)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO documents (sha256, size, page_count, image_pages, field, stored, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (sha256) DO UPDATE SET used = excluded.used",
+                (ingested.sha256, ingested.size, ingested.page_count, ingested.image_pages, name, now, now),
+            )
+            self._db.commit()
+        self.sweep()
+
+    def save_all(self, files: Dict[str, IngestedFile]) -> None:
+        for name, ingested in files.items():
+            self.save(name, ingested)
+
+    def save_results(self, files: Dict[str, IngestedFile], jobs: Dict[str, tuple], results: Dict[str, dict]) -> None:
+        """Record each document's validator result under the form values it was checked against."""
+        now = time.time()
+        rows = [
+            (files[name].sha256, name, _params_hash(kwargs), json.dumps(kwargs), json.dumps(results[name]), now)
+            for name, (_, _, kwargs) in jobs.items()
+            if name in results and "error" not in results[name]
+        ]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+
+    def open(self, sha256: str) -> Optional[IngestedFile]:
+        """The stored PDF as an upload that closing does not delete, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, page_count, image_pages, field FROM documents WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+            if row is None or not os.path.exists(self.path(sha256)):
+                return None
+            self._db.execute("UPDATE documents SET used = ? WHERE sha256 = ?", (time.time(), sha256))
+            self._db.commit()
+        size, page_count, image_pages, field = row
+        ingested = IngestedFile(field or sha256, sha256, size, path=self.path(sha256))
+        ingested.page_count = page_count
+        ingested.image_pages = image_pages
+        ingested.keep = True
+        return ingested
+
+    def lookup(self, sha256: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, page_count, image_pages, field, stored, used FROM documents WHERE sha256 = ?",
+                (sha256,),
+            ).fetchone()
+            if row is None:
+                return None
+            results = self._db.execute(
+                "SELECT field, kwargs, result, created FROM results WHERE sha256 = ? ORDER BY created DESC",
+                (sha256,),
+            ).fetchall()
+        size, page_count, image_pages, field, stored, used = row
+        return {
+            "sha256": sha256,
+            "size": size,
+            "page_count": page_count,
+            "image_pages": image_pages,
+            "field": field,
+            "stored": stored,
+            "used": used,
+            "expires": used + self.ttl,
+            "results": [
+                {"field": name, "params": json.loads(kwargs), "result": json.loads(result), "created": created}
+                for name, kwargs, result, created in results
+            ],
+        }
+
+    def sweep(self, force: bool = False) -> List[str]:
+        """Evict expired documents, then the least recently used ones over max_bytes."""
+        now = time.time()
+        if not force and now - self._last_sweep < self.sweep_seconds:
+            return []
+        self._last_sweep = now
+        with self._lock:
+            evicted = [
+                row[0] for row in
+                self._db.execute("SELECT sha256 FROM documents WHERE used < ?", (now - self.ttl,)).fetchall()
+            ]
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM documents WHERE used >= ?",
+                                     (now - self.ttl,)).fetchone()[0]
+            if total > self.max_bytes:
+                for sha256, size in self._db.execute(
+                    "SELECT sha256, size FROM documents WHERE used >= ? ORDER BY used", (now - self.ttl,)
+                ):
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append(sha256)
+                    total -= size
+            extractions = self._db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'extractions'"
+            ).fetchone()
+            for sha256 in evicted:
+                self._db.execute("DELETE FROM documents WHERE sha256 = ?", (sha256,))
+                self._db.execute("DELETE FROM results WHERE sha256 = ?", (sha256,))
+                if extractions:
+                    # Extraction cache keys start with the content hash
+                    self._db.execute("DELETE FROM extractions WHERE key LIKE ?", (f"{sha256}:%",))
+            self._db.commit()
+        for sha256 in evicted:
+            try:
+                os.remove(self.path(sha256))
+            except FileNotFoundError:
+                pass
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents").fetchone()
+        return {"documents": count, "bytes": size, "max_bytes": self.max_bytes, "ttl_days": self.ttl / 86400}
+
+
+document_store = DocumentStore(DOCUMENT_STORE_DIR) if DOCUMENT_STORE_DIR else None
@@ -0,0 +1,51 @@
+"""Page classification of scans that already carry a text layer (see extraction.classify_page)."""
+import fitz  # PyMuPDF
+
+from extraction import classify_page
+
+LINES = ["Uittreksel uit het strafregister", "Naam: Peeters  Voornaam: Jan", "Datum van afgifte: 10/10/2026"]
+
+
+def _scan(page, rect):
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 200, 280), False)
+    pixmap.clear_with(230)
+    page.insert_image(rect, pixmap=pixmap)
+
+
+def _classify(build):
+    doc = fitz.open()
+    page = doc.new_page()
+    build(page)
+    doc = fitz.open("pdf", doc.tobytes())
+    return classify_page(doc[0], doc[0].get_text())
+
+
+def test_sandwich_page_is_read_from_its_text_layer():
+    # A full-page scan with an invisible OCR layer of a few lines: the text
+    # covers far less than half of the image
+    def build(page):
+        _scan(page, page.rect)
+        for number, line in enumerate(LINES):
+            page.insert_text((72, 100 + 20 * number), line, render_mode=3)
+
+    extracted = _classify(build)
+    assert extracted.kind == "text"
+    assert not extracted.ocr_regions
+
+
+def test_scan_pasted_into_typed_page_is_ocrd():
+    def build(page):
+        for number, line in enumerate(LINES):
+            page.insert_text((72, 72 + 20 * number), line)
+        _scan(page, fitz.Rect(72, 300, 400, 700))
+
+    extracted = _classify(build)
+    assert extracted.kind == "mixed"
+    # Only the scan, which keeps its aspect ratio inside the rect
+    [region] = extracted.ocr_regions
+    assert region[1] == 300 and region[3] == 700
+
+
+def test_scan_without_text_layer_is_ocrd():
+    extracted = _classify(lambda page: _scan(page, page.rect))
+    assert extracted.kind == "image"
@@ -1,94 +1,96 @@
-import fitz  # PyMuPDF
-import io
+import logging
 import re
 from datetime import datetime , timedelta
-import easyocr
-from PIL import Image
 from dateutil.parser import parse
+from functools import wraps
+from typing import Callable
 
+from extraction import ExtractedDocument, as_document, extract_document
+from layout import document_layout
+from matcher import (
+    ADDRESS_LINE, CONFORMITY, FUZZY_MATCH_THRESHOLD, LOCATED_AT, LOCATED_AT_COMPLETE,
+    SELLER, digits_of, field_similarity, id_card_dates, morality_date_string, normalize_address,
+    period_end_dates, views,
+)
+from metrics import span
 
-def detect_pdf_type(file_bytes: bytes) -> str:
-    try:
-        doc = fitz.open("pdf", file_bytes)
-        for page in doc:
-            text = page.get_text()
-            if text.strip():
-                return "text"
-            # fallback check
-            images = page.get_images(full=True)
-            if images:
-                return "image"
-        return "empty"
-    except Exception:
-        return "unreadable"
-
-
-reader = easyocr.Reader(['en', 'nl'])
-
-def validate_id_card(file_bytes: bytes, firstName: str, lastName: str) -> dict:
-    try:
-        # Improved text extraction with PDF type detection
-        def detect_pdf_type(file_bytes: bytes) -> str:
-            with fitz.open("pdf", file_bytes) as doc:
-                return "text" if any(page.get_text().strip() for page in doc) else "image"
 
-        pdf_type = detect_pdf_type(file_bytes)
-        text = ""
-        
-        with fitz.open("pdf", file_bytes) as doc:
-            for page in doc:
-                if pdf_type == "text":
-                    text += page.get_text()
-                else:
-                    pix = page.get_pixmap()
-                    img = Image.open(io.BytesIO(pix.tobytes("png")))
-                    img_bytes = io.BytesIO()
-                    img.save(img_bytes, format='PNG')
-                    img_bytes.seek(0)
-                    results = reader.readtext(img_bytes.getvalue(), detail=0)
-                    text += " ".join(results)
+logger = logging.getLogger(__name__)
+
+
+def _any_page(text: str) -> bool:
+    # The first page that is not empty decides the type; empty pages are never checked (see _parse)
+    return True
+
+
+def detect_pdf_type(document) -> str:
+    # Accepts raw bytes or an already extracted document; never runs OCR, and
+    # raw bytes are read only up to the first page that is not empty
+    with span("detect_pdf_type"):
+        if isinstance(document, ExtractedDocument):
+            return document.pdf_type
+        extracted = extract_document(document, ocr=False, until=_any_page)
+        if extracted.pdf_type == "empty" and len(extracted.pages) < extracted.page_count:
+            # A cached entry that stopped on empty pages, e.g. at a page budget
+            extracted = extract_document(document, ocr=False)
+        return extracted.pdf_type
+
+
+def _score(value: float) -> float:
+    return round(value, 3)
+
+
+# Validators that read values next to their labels (see layout.py); their
+# documents are extracted with word boxes
+LAYOUT_VALIDATORS = {"validate_commercial_lease", "validate_electric_certificate"}
+
+
+def uses_layout(validator) -> bool:
+    return getattr(validator, "__name__", None) in LAYOUT_VALIDATORS
+
+
+def _timed(validator):
+    # Reading the document is timed by the extraction stages; the span covers the matching
+    @wraps(validator)
+    def wrapper(document, *args, **kwargs):
+        try:
+            document = as_document(document, layout=uses_layout(validator))
+        except Exception as e:
+            return {"error": str(e)}
+        with span("match"):
+            return validator(document, *args, **kwargs)
+    return wrapper
+
 
-        normalized_text = text.lower().replace('\n', ' ').replace('  ', ' ')
-        clean_text = re.sub(r'[^a-z0-9./-]', ' ', normalized_text)  # Keep date separators
+def _id_card_name_pattern(firstName: str, lastName: str) -> str:
+    first_name = re.escape(firstName.lower())
+    last_name = re.escape(lastName.lower())
+    return rf"\b{first_name}\b.*?\b{last_name}\b|\b{last_name}\b.*?\b{first_name}\b"
+
+
+@_timed
+def validate_id_card(document: ExtractedDocument, firstName: str, lastName: str) -> dict:
+    try:
+        document = as_document(document)
+        if document.error is not None:
+            return {"error": document.error}
+        text = views(document.text)
+        clean_text = text.id_clean
 
         # Enhanced name matching
-        first_name = re.escape(firstName.lower())
-        last_name = re.escape(lastName.lower())
-        name_pattern = rf"\b{first_name}\b.*?\b{last_name}\b|\b{last_name}\b.*?\b{first_name}\b"
-        name_match = bool(re.search(name_pattern, clean_text, re.IGNORECASE))
-
-        # Robust date extraction patterns
-        date_patterns = [
-            # Handle OCR errors in "valid until" with flexible matching
-            (r"(?:geldig|valid|valable|verloopt|expires?)[^\d]{1,20}(\d{2}[./-]\d{2}[./-]\d{4})", "%d.%m.%Y"),
-            # General date patterns
-            (r"\b(\d{2}[./-]\d{2}[./-]\d{4})\b", "%d.%m.%Y"),
-            (r"\b(\d{4}[./-]\d{2}[./-]\d{2})\b", "%Y-%m-%d"),
-            (r"\b(\d{2}\s\d{2}\s\d{4})\b", "%d %m %Y"),
-        ]
+        name_match = bool(re.search(_id_card_name_pattern(firstName, lastName), clean_text, re.IGNORECASE))
 
+        # Labelled expiry and every other date, in one scan
         current_date = datetime.now()
-        exp_dates = []
-
-        for pattern, fmt in date_patterns:
-            for match in re.finditer(pattern, clean_text, re.IGNORECASE):
-                date_str = match.group(1)
-                try:
-                    # Normalize date separators
-                    date_str = re.sub(r'[/-]', '.', date_str)
-                    parsed_date = datetime.strptime(date_str, fmt)
-                    if parsed_date > current_date:
-                        exp_dates.append(parsed_date)
-                except ValueError:
-                    continue
-
-        # Find latest valid date
+        exp_dates = [parsed_date for parsed_date in id_card_dates(text) if parsed_date > current_date]
+
+        # The first date still valid; reading stops once one is found (see
+        # _id_card_fields), so a later one would not be reported consistently
         expiry_valid = False
         expiry_date = "Not found"
         if exp_dates:
-            latest_date = max(exp_dates)
-            expiry_date = latest_date.strftime("%Y-%m-%d")
-            expiry_valid = latest_date > current_date
+            expiry_date = exp_dates[0].strftime("%Y-%m-%d")
+            expiry_valid = True
 
         return {
             "name_match": name_match,
@@ -102,105 +104,64 @@ def validate_id_card(file_bytes: bytes, firstName: str, lastName: str) -> dict:
     
 
 
+@_timed
 def validate_kbo_register_extract(
-    file_bytes: bytes,
+    document: ExtractedDocument,
     companyName: str,
     companyNumber: str,
     ownerFirstName: str,
     ownerLastName: str
 ) -> dict:
     try:
-        pdf_type = detect_pdf_type(file_bytes)
-        text = ""
-        # print("User Company number is ", companyNumber)
-        
-        with fitz.open("pdf", file_bytes) as doc:
-            for page in doc:
-                if pdf_type == "text":
-                    text += page.get_text()
-                else:
-                    pix = page.get_pixmap()
-                    img = Image.open(io.BytesIO(pix.tobytes("png")))
-                    img_bytes = io.BytesIO()
-                    img.save(img_bytes, format='PNG')
-                    img_bytes.seek(0)
-                    results = reader.readtext(img_bytes.getvalue(), detail=0)
-                    text += " ".join(results)
-
-        normalized_text = text.lower().replace('\n', ' ')
-        # Remove all non-digit characters for number comparison
-        plain_text = re.sub(r'\D', '', normalized_text)  # Corrected line
-
-        # Company Name Match
-        company_name_match = companyName.lower() in normalized_text
-
-        # Company Number Match: Check if stripped number exists in the cleaned text
-        stripped_company_number = re.sub(r'\D', '', companyNumber)
-        company_number_match = stripped_company_number in plain_text  # Corrected check
-
-        # Owner/Manager Name Match
-        owner_full_name = f"{ownerFirstName} {ownerLastName}".lower()
-        first_name_found = ownerFirstName.lower() in normalized_text
-        last_name_found = ownerLastName.lower() in normalized_text
-        full_name_found = owner_full_name in normalized_text
-        manager_name_match = full_name_found or (first_name_found and last_name_found)
+        document = as_document(document)
+        if document.error is not None:
+            return {"error": document.error}
+        text = views(document.text)
+
+        # Company name tolerating a few OCR errors; the number must match exactly
+        company_name_score, _ = text.fuzzy_find(companyName)
+        company_number_score = text.number_score(companyNumber)
+
+        # Owner/Manager Name Match: the full name, or first and last name apart
+        full_name_score, _ = text.fuzzy_find(f"{ownerFirstName} {ownerLastName}")
+        first_name_score, _ = text.fuzzy_find(ownerFirstName)
+        last_name_score, _ = text.fuzzy_find(ownerLastName)
+        manager_name_score = max(full_name_score, min(first_name_score, last_name_score))
 
         return {
-            "company_name_match": company_name_match,
-            "company_number_match": company_number_match,
-            "manager_name_match": manager_name_match,
+            "company_name_match": company_name_score >= FUZZY_MATCH_THRESHOLD,
+            "company_number_match": company_number_score >= FUZZY_MATCH_THRESHOLD,
+            "manager_name_match": manager_name_score >= FUZZY_MATCH_THRESHOLD,
+            "company_name_score": _score(company_name_score),
+            "company_number_score": _score(company_number_score),
+            "manager_name_score": _score(manager_name_score),
             # "extracted_text": text
         }
 
     except Exception as e:
         return {"error": str(e)}
 
+@_timed
 def validate_official_gazette_publication(
-    file_bytes: bytes,
+    document: ExtractedDocument,
     companyName: str,
     companyNumber: str
 ) -> dict:
     try:
-        def detect_pdf_type(file_bytes: bytes) -> str:
-            """Returns 'text' if PDF contains text layers, 'image' otherwise"""
-            with fitz.open("pdf", file_bytes) as doc:
-                for page in doc:
-                    if page.get_text().strip():
-                        return "text"
-                return "image"
-
-        pdf_type = detect_pdf_type(file_bytes)
-        extracted_text = ""
-        
-        # Extract text from PDF
-        with fitz.open("pdf", file_bytes) as doc:
-            for page in doc:
-                if pdf_type == "text":
-                    extracted_text += page.get_text()
-                else:
-                    # OCR processing for image-based PDFs
-                    pix = page.get_pixmap()
-                    img = Image.open(io.BytesIO(pix.tobytes("png")))
-                    img_bytes = io.BytesIO()
-                    img.save(img_bytes, format='PNG')
-                    img_bytes.seek(0)
-                    ocr_results = reader.readtext(img_bytes.getvalue(), detail=0)
-                    extracted_text += " ".join(ocr_results)
-
-        # Normalization and cleaning
-        normalized_text = extracted_text.lower().replace('\n', ' ')
-        digits_only_text = re.sub(r'\D', '', normalized_text)  # Remove all non-digits
-        
-        # Company name check (case-insensitive substring match)
-        company_name_match = companyName.lower() in normalized_text
-        
-        # Company number check (exact digit sequence match)
-        cleaned_company_number = re.sub(r'\D', '', companyNumber)
-        company_number_match = cleaned_company_number in digits_only_text
+        document = as_document(document)
+        if document.error is not None:
+            return {"error": document.error}
+        text = views(document.text)
+
+        # Company name tolerating a few OCR errors; the number must match exactly
+        company_name_score, _ = text.fuzzy_find(companyName)
+        company_number_score = text.number_score(companyNumber)
 
         return {
-            "company_name_match": company_name_match,
-            "company_number_match": company_number_match,
+            "company_name_match": company_name_score >= FUZZY_MATCH_THRESHOLD,
+            "company_number_match": company_number_score >= FUZZY_MATCH_THRESHOLD,
+            "company_name_score": _score(company_name_score),
+            "company_number_score": _score(company_number_score),
             # "extracted_text": extracted_text
         }
 
@@ -208,37 +169,19 @@ def validate_official_gazette_publication(
         return {"error": str(e)}
 
 
+@_timed
 def validate_morality_certificate(
-    file_bytes: bytes,
+    document: ExtractedDocument,
     firstName: str,
     lastName: str
 ) -> dict:
     try:
-        # PDF type detection
-        def detect_pdf_type(file_bytes: bytes) -> str:
-            with fitz.open("pdf", file_bytes) as doc:
-                return "text" if any(page.get_text().strip() for page in doc) else "image"
-
-        # Text extraction
-        pdf_type = detect_pdf_type(file_bytes)
-        extracted_text = ""
-        
-        with fitz.open("pdf", file_bytes) as doc:
-            for page in doc:
-                if pdf_type == "text":
-                    extracted_text += page.get_text()
-                else:
-                    pix = page.get_pixmap()
-                    img = Image.open(io.BytesIO(pix.tobytes("png")))
-                    img_bytes = io.BytesIO()
-                    img.save(img_bytes, format='PNG')
-                    img_bytes.seek(0)
-                    ocr_results = reader.readtext(img_bytes.getvalue(), detail=0)
-                    extracted_text += " ".join(ocr_results)
-
-        # Normalization
-        normalized_text = extracted_text.lower().replace('\n', ' ')
-        clean_text = re.sub(r'[^\w\s/]', '', normalized_text)  # Keep slashes for dates
+        document = as_document(document)
+        if document.error is not None:
+            return {"error": document.error}
+        text = views(document.text)
+        normalized_text = text.lower
+        clean_text = text.morality_clean
 
         # Name validation
         first_name = firstName.lower().strip()
@@ -254,18 +197,11 @@ def validate_morality_certificate(
         certificate_date = None
         today = datetime.now().date()
         
-        # Improved date pattern matching
-        date_pattern = r'(?:datum\s*:?\s*)(\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4})'
-        match = re.search(date_pattern, normalized_text, re.IGNORECASE)
-        
-        if not match:
-            # Fallback to find first date after "Datum"
-            date_section = normalized_text.split('datum', 1)[-1]
-            match = re.search(r'\b(\d{1,2}[/\-\.]\d{1,2}[/\-\.]\d{2,4})\b', date_section)
+        # Date after "Datum", or the first date following it
+        date_str = morality_date_string(text)
 
-        if match:
+        if date_str:
             try:
-                date_str = match.group(1)
                 # Handle different date separators
                 date_str = re.sub(r'[/\-\.]', '/', date_str)
                 certificate_date = parse(date_str, dayfirst=True).date()
@@ -277,7 +213,7 @@ def validate_morality_certificate(
                     date_valid = (today - certificate_date) <= timedelta(days=30)
                     
             except Exception as date_error:
-                print(f"Date parsing error: {date_error}")
+                logger.warning("Date parsing error: %s", date_error)
                 date_valid = False
 
         return {
@@ -292,55 +228,28 @@ def validate_morality_certificate(
         return {"error": str(e)}
     
 
+@_timed
 def validate_commercial_lease(
-    file_bytes: bytes,
+    document: ExtractedDocument,
     building_owner_name: str,
     restaurant_address: str
 ) -> dict:
     try:
-        # PDF type detection
-        def detect_pdf_type(file_bytes: bytes) -> str:
-            """Detect if PDF contains text layers"""
-            with fitz.open("pdf", file_bytes) as doc:
-                return "text" if any(page.get_text().strip() for page in doc) else "image"
-
         # Extract text from PDF
-        pdf_type = detect_pdf_type(file_bytes)
-        extracted_text = ""
-        
-        with fitz.open("pdf", file_bytes) as doc:
-            for page in doc:
-                if pdf_type == "text":
-                    extracted_text += page.get_text()
-                else:
-                    pix = page.get_pixmap()
-                    img = Image.open(io.BytesIO(pix.tobytes("png")))
-                    img_bytes = io.BytesIO()
-                    img.save(img_bytes, format='PNG')
-                    img_bytes.seek(0)
-                    ocr_results = reader.readtext(img_bytes.getvalue(), detail=0)
-                    extracted_text += " ".join(ocr_results)
-
-        # Normalization function
-        def normalize(text: str) -> str:
-            text = text.lower()
-            text = re.sub(r'[^a-z0-9]', '', text)  # Remove all non-alphanumeric
-            return text.strip()
-
-        # Extract seller details
-        seller_match = re.search(
-            r'Seller:\s*Name:\s*(.*?)\s*Address:\s*(.*?)\s*VAT',
-            extracted_text, 
-            re.IGNORECASE | re.DOTALL
-        )
-        pdf_owner_name = seller_match.group(1).strip() if seller_match else ""
+        document = as_document(document)
+        if document.error is not None:
+            return {"error": document.error}
+        extracted_text = document.text
+
+        # Extract seller details: the value next to the label, else the text after it
+        layout = document_layout(document)
+        pdf_owner_name = (layout.value("Seller: Name:") if layout is not None else None) or ""
+        if not pdf_owner_name:
+            seller_match = SELLER.search(extracted_text)
+            pdf_owner_name = seller_match.group(1).strip() if seller_match else ""
 
         # Improved address extraction
-        address_match = re.search(
-            r'located at\s+(.*?)\s*(?=\bthe Buyer\b|$)',
-            extracted_text,
-            re.IGNORECASE | re.DOTALL
-        )
+        address_match = LOCATED_AT.search(extracted_text)
         
         if address_match:
             pdf_restaurant_address = address_match.group(1).strip()
@@ -349,19 +258,15 @@ def validate_commercial_lease(
         else:
             pdf_restaurant_address = ""
 
-        # Normalize values for comparison
-        norm_form_owner = normalize(building_owner_name)
-        norm_pdf_owner = normalize(pdf_owner_name)
-        norm_form_address = normalize(restaurant_address)
-        norm_pdf_address = normalize(pdf_restaurant_address)
-
-        # Validation checks
-        owner_match = norm_form_owner == norm_pdf_owner
-        address_match = norm_form_address == norm_pdf_address
+        # Validation checks: numbers and legal forms exact, a few OCR errors in the words
+        owner_score = field_similarity(building_owner_name, pdf_owner_name)
+        address_score = field_similarity(restaurant_address, pdf_restaurant_address)
 
         return {
-            "building_owner_match": owner_match,
-            "restaurant_address_match": address_match,
+            "building_owner_match": owner_score >= FUZZY_MATCH_THRESHOLD,
+            "restaurant_address_match": address_score >= FUZZY_MATCH_THRESHOLD,
+            "building_owner_score": _score(owner_score),
+            "restaurant_address_score": _score(address_score),
             "extracted_owner": pdf_owner_name,
             "extracted_address": pdf_restaurant_address,
             # "extracted_text": extracted_text
@@ -370,85 +275,35 @@ def validate_commercial_lease(
     except Exception as e:
         return {"error": str(e)}
 
-def validate_liability_insurance(file_bytes: bytes, company_name: str) -> dict:
+@_timed
+def validate_liability_insurance(document: ExtractedDocument, company_name: str) -> dict:
     try:
-        def detect_pdf_type(file_bytes: bytes) -> str:
-            with fitz.open("pdf", file_bytes) as doc:
-                return "text" if any(page.get_text().strip() for page in doc) else "image"
+        document = as_document(document)
+        if document.error is not None:
+            return {"error": document.error}
+        extracted_text = document.text
 
-        pdf_type = detect_pdf_type(file_bytes)
-        extracted_text = ""
+        company_name_score, _ = views(extracted_text).fuzzy_find(company_name)
 
-        with fitz.open("pdf", file_bytes) as doc:
-            for page in doc:
-                if pdf_type == "text":
-                    extracted_text += page.get_text()
-                else:
-                    pix = page.get_pixmap()
-                    img = Image.open(io.BytesIO(pix.tobytes("png")))
-                    img_bytes = io.BytesIO()
-                    img.save(img_bytes, format='PNG')
-                    img_bytes.seek(0)
-                    ocr_results = reader.readtext(img_bytes.getvalue(), detail=0)
-                    extracted_text += " ".join(ocr_results)
-
-        # Normalize text
-        processed_text = extracted_text.replace('\n', ' ')
-        processed_text = ' '.join(processed_text.split())
-        normalized_text = processed_text.lower()
-
-        company_name_match = company_name.lower() in normalized_text
-
-        month_map = {
-            'januari': '01', 'january': '01',
-            'februari': '02', 'february': '02',
-            'maart': '03', 'march': '03',
-            'april': '04',
-            'mei': '05', 'may': '05',
-            'juni': '06', 'june': '06',
-            'juli': '07', 'july': '07',
-            'augustus': '08', 'august': '08',
-            'september': '09',
-            'oktober': '10', 'october': '10',
-            'november': '11',
-            'december': '12'
-        }
-
-        def parse_date(date_str: str) -> str:
-            date_str = re.sub(r'[/.-]', ' ', date_str)
-            parts = re.split(r'\s+', date_str.strip())
-            if len(parts) == 3:
-                day, month, year = parts
-                if month.lower() in month_map:
-                    month = month_map[month.lower()]
-                return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-            return None
-
-        # Enhanced regex to tolerate newlines and extra words
-        date_range_pattern = r"van\s+(\d{1,2}\s+\w+\s+\d{4})\s+tot\s+(\d{1,2}\s+\w+\s+\d{4})"
-        matches = re.findall(date_range_pattern, extracted_text, flags=re.IGNORECASE)
-
-        end_dates = []
-        for _, end_date_str in matches:
-            try:
-                parsed = parse_date(end_date_str)
-                if parsed:
-                    end_dates.append(datetime.strptime(parsed, "%Y-%m-%d").date())
-            except Exception:
-                continue
+        # Tolerates newlines and extra words between the dates
+        end_dates = period_end_dates(extracted_text)
 
         current_date = datetime.now().date()
-        expired = True
-        latest_end_date = None
+        expiry_valid = False
+        end_date = None
 
         if end_dates:
-            latest_end_date = max(end_dates)
-            expiry_valid = latest_end_date > current_date
+            # The first period still running, else the last one that ended;
+            # reading stops once a running one is found (see _liability_insurance_fields)
+            running = [period_end for period_end in end_dates if period_end > current_date]
+            end_date = running[0] if running else max(end_dates)
+            expiry_valid = end_date > current_date
 
         return {
-            "company_name_match": company_name_match,
+            "company_name_match": company_name_score >= FUZZY_MATCH_THRESHOLD,
+            "company_name_score": _score(company_name_score),
             "expiry_valid": expiry_valid,
-            "end_date": latest_end_date.isoformat() if latest_end_date else None,
+            "end_date": end_date.isoformat() if end_date else None,
             "current_date": current_date.isoformat(),
             # "extracted_text": extracted_text
         }
@@ -456,47 +311,33 @@ def validate_liability_insurance(file_bytes: bytes, company_name: str) -> dict:
     except Exception as e:
         return {"error": str(e)} 
 
-def validate_electric_certificate(file_bytes: bytes, expected_address: str) -> dict:
-    try:
-        def detect_pdf_type(file_bytes):
-            with fitz.open("pdf", file_bytes) as doc:
-                return "text" if any(page.get_text().strip() for page in doc) else "image"
 
-        pdf_type = detect_pdf_type(file_bytes)
-        extracted_text = ""
+def _address_line_matches(line: str, norm_expected: str) -> bool:
+    norm_line = normalize_address(line)
+    return bool(norm_line and norm_line in norm_expected or norm_expected in norm_line)
 
-        with fitz.open("pdf", file_bytes) as doc:
-            for page in doc:
-                if pdf_type == "text":
-                    extracted_text += page.get_text()
-                else:
-                    pix = page.get_pixmap()
-                    img = Image.open(io.BytesIO(pix.tobytes("png")))
-                    img_bytes = io.BytesIO()
-                    img.save(img_bytes, format='PNG')
-                    img_bytes.seek(0)
-                    ocr_results = reader.readtext(img_bytes.getvalue(), detail=0)
-                    extracted_text += " ".join(ocr_results)
 
-        # Check for conformity statement
-        conformity_match = re.search(r'DE INSTALLATIE IS CONFORM', extracted_text, re.IGNORECASE) is not None
+@_timed
+def validate_electric_certificate(document: ExtractedDocument, expected_address: str) -> dict:
+    try:
+        document = as_document(document)
+        if document.error is not None:
+            return {"error": document.error}
+        extracted_text = document.text
 
-        # Normalize function
-        def normalize_address(address):
-            cleaned = re.sub(r'[^a-zA-Z0-9\s,]', '', address.lower())
-            cleaned = re.sub(r'\s+', ' ', cleaned).replace(',', ' ').strip()
-            return re.sub(r'\s{2,}', ' ', cleaned)
+        # Check for conformity statement
+        conformity_match = CONFORMITY.search(extracted_text) is not None
 
-        # Extract all address lines
-        address_lines = re.findall(r'Adres:\s*(.*)', extracted_text, re.IGNORECASE)
+        # Extract all address lines; with word boxes, a value in another column or below its label is found too
+        layout = document_layout(document)
+        address_lines = (layout.values("Adres:") if layout is not None else []) + ADDRESS_LINE.findall(extracted_text)
 
         extracted_address = ""
         address_match = False
         norm_expected = normalize_address(expected_address)
 
         for line in address_lines:
-            norm_line = normalize_address(line)
-            if norm_line and norm_line in norm_expected or norm_expected in norm_line:
+            if _address_line_matches(line, norm_expected):
                 extracted_address = line.strip()
                 address_match = True
                 break  # Stop on first match
@@ -514,3 +355,163 @@ def validate_electric_certificate(file_bytes: bytes, expected_address: str) -> d
         return {"error": str(e)}
 
 
+
+
+# Fields each validator needs. Reading a document stops as soon as the text
+# read so far holds all of them (see ExtractedDocument.until), so a check may
+# only accept once more pages can no longer change the validator's verdict:
+# the same matching the validator does, and e.g. a future end date rather
+# than any end date.
+
+class RequiredFields:
+    """All of a validator's field checks; each one takes a text and must keep
+    accepting when text is added, so text layers can be checked page by page."""
+
+    def __init__(self, *checks: Callable[[str], bool]):
+        self.checks = checks
+
+    def __call__(self, text: str) -> bool:
+        return all(check(text) for check in self.checks)
+
+
+def _contains(needle: str) -> Callable[[str], bool]:
+    needle = needle.lower().strip()
+    return lambda text: needle in text.lower()
+
+
+def _contains_number(number: str) -> Callable[[str], bool]:
+    digits = digits_of(number)
+    return lambda text: bool(digits) and digits in digits_of(text)
+
+
+def _search(pattern: re.Pattern) -> Callable[[str], bool]:
+    return lambda text: pattern.search(text) is not None
+
+
+def _id_card_fields(firstName: str, lastName: str):
+    name_pattern = _id_card_name_pattern(firstName, lastName)
+    return RequiredFields(
+        lambda text: re.search(name_pattern, views(text).id_clean, re.IGNORECASE) is not None,
+        lambda text: any(parsed_date > datetime.now() for parsed_date in id_card_dates(views(text))),
+    )
+
+
+def _kbo_register_fields(companyName: str, companyNumber: str, ownerFirstName: str, ownerLastName: str):
+    return RequiredFields(
+        _contains(companyName), _contains_number(companyNumber), _contains(ownerFirstName), _contains(ownerLastName)
+    )
+
+
+def _official_gazette_fields(companyName: str, companyNumber: str):
+    return RequiredFields(_contains(companyName), _contains_number(companyNumber))
+
+
+def _morality_certificate_fields(firstName: str, lastName: str):
+    first_name, last_name = firstName.lower().strip(), lastName.lower().strip()
+    return RequiredFields(
+        lambda text: first_name in views(text).morality_clean,
+        lambda text: last_name in views(text).morality_clean,
+        # The validator's own date; without a "datum" label yet, a later one would replace it
+        lambda text: "datum" in views(text).lower and morality_date_string(views(text)) is not None,
+    )
+
+
+def _commercial_lease_fields(building_owner_name: str, restaurant_address: str):
+    # The address is only complete once the text after it ("the Buyer") is read
+    return RequiredFields(_search(SELLER), _search(LOCATED_AT_COMPLETE))
+
+
+def _liability_insurance_fields(company_name: str):
+    # An expired period may be followed by its renewal, so only a future end date settles it
+    return RequiredFields(
+        _contains(company_name),
+        lambda text: any(end_date > datetime.now().date() for end_date in period_end_dates(text)),
+    )
+
+
+def _electric_certificate_fields(expected_address: str):
+    norm_expected = normalize_address(expected_address)
+    return RequiredFields(
+        _search(CONFORMITY),
+        lambda text: any(_address_line_matches(line, norm_expected) for line in ADDRESS_LINE.findall(text)),
+    )
+
+
+REQUIRED_FIELDS = {
+    validate_id_card: _id_card_fields,
+    validate_kbo_register_extract: _kbo_register_fields,
+    validate_official_gazette_publication: _official_gazette_fields,
+    validate_morality_certificate: _morality_certificate_fields,
+    validate_commercial_lease: _commercial_lease_fields,
+    validate_liability_insurance: _liability_insurance_fields,
+    validate_electric_certificate: _electric_certificate_fields,
+}
+
+
+def required_fields(validator, kwargs: dict):
+    """Predicate telling when a document holds everything `validator` looks for."""
+    builder = REQUIRED_FIELDS.get(validator)
+    return builder(**kwargs) if builder else None
+
+
+# Upload field -> (response key, validator, form fields -> validator kwargs)
+DOCUMENT_VALIDATIONS = {
+    "IDCardAttachment": (
+        "id_card_valid", validate_id_card,
+        lambda form: dict(firstName=form["firstName"], lastName=form["lastName"]),
+    ),
+    "KBORegisterExtract": (
+        "kbo_register_valid", validate_kbo_register_extract,
+        lambda form: dict(companyName=form["companyName"], companyNumber=form["companyNumber"],
+                          ownerFirstName=form["firstName"], ownerLastName=form["lastName"]),
+    ),
+    "OfficialGazettePublication": (
+        "official_gazette_valid", validate_official_gazette_publication,
+        lambda form: dict(companyName=form["companyName"], companyNumber=form["companyNumber"]),
+    ),
+    "MoralityCertificate": (
+        "morality_certificate_valid", validate_morality_certificate,
+        lambda form: dict(firstName=form["firstName"], lastName=form["lastName"]),
+    ),
+    "CommercialLeaseAgreement": (
+        "commercial_lease_valid", validate_commercial_lease,
+        lambda form: dict(building_owner_name=form["ownerName"], restaurant_address=form["businessAddress"]),
+    ),
+    "LiabilityInsuranceCopy": (
+        "liability_insurance_valid", validate_liability_insurance,
+        lambda form: dict(company_name=form["companyName"]),
+    ),
+    "ElectricCertificate": (
+        "electric_certificate_valid", validate_electric_certificate,
+        lambda form: dict(expected_address=form["businessAddress"]),
+    ),
+}
+
+
+def validation_jobs(files: dict, form: dict) -> dict:
+    """Scheduler jobs for the uploads in `files`, keyed by upload field."""
+    return {
+        name: (files[name], validator, kwargs(form))
+        for name, (_, validator, kwargs) in DOCUMENT_VALIDATIONS.items()
+        if name in files
+    }
+
+
+def validation_response(results: dict, documents: dict) -> dict:
+    """The /validate-documents response body for scheduler output."""
+    response = {
+        "pdf_checks": {
+            name: detect_pdf_type(documents[name]) if name in documents else "unreadable"
+            for name in results
+        },
+    }
+    for name, (key, _, _) in DOCUMENT_VALIDATIONS.items():
+        if name in results:
+            response[key] = results[name]
+    # Reading stops at the page budget or once every field is found
+    response["pages_examined"] = {
+        name: {"pages": document.examined_pages, "page_count": document.page_count}
+        for name, document in documents.items()
+        if name in results and document.error is None
+    }
+    return response